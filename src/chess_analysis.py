@@ -0,0 +1,233 @@
+"""
+chess_analysis.py
+
+Post game analysis. Every position of finished games is searched to a fixed node (or
+time) budget and each move gets the engine's score, the best move, the centipawns it
+lost against the best move and a flag for inaccuracies, mistakes and blunders.
+Games are read one at a time and handed to a pool of worker processes with only a few
+per worker in flight, so memory doesn't grow with the input, and the results come out
+as JSON lines in the order the games went in.
+
+Input : PGN files, or text files of move logs with one game per line in coordinate
+        notation (e2e4 e7e5 ...), see movesFromLog for a GameState.moveLog
+
+Usage : python -m Chess.src.chess_analysis games.pgn --nodes 20000 --workers 8 > analysis.jsonl
+"""
+
+__date__ = "2026-10-18"
+__author__ = "WilliamGasson"
+__version__ = "0.1"
+
+
+# %% --------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import Chess.src.chess_computer as cc
+import Chess.src.chess_engine as ce
+import Chess.src.chess_pgn as cp
+from Chess.src.chess_perft import moveNotation
+
+# %% --------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+ANALYSIS_BACKEND = "bitboard"
+ANALYSIS_NODES = 20000  # search budget for each position when no time or depth is given
+IN_FLIGHT_PER_WORKER = 2  # games queued per worker, enough to keep them busy without reading the whole input
+SCORE_CAP = 1000  # centipawns, mate scores are capped so one missed mate doesn't swamp the averages
+# centipawns lost for each flag, the biggest one reached is given
+FLAGS = ((300, "blunder"), (100, "mistake"), (50, "inaccuracy"))
+
+# %% --------------------------------------------------------------------------
+# Reading games
+# -----------------------------------------------------------------------------
+
+
+def movesFromLog(moveLog):
+    # a GameState.moveLog as the coordinate notation the analysis reads
+    return [moveNotation(move) for move in moveLog]
+
+
+def readMoveLogs(path):
+    # one game per line of coordinate moves, yields (tags, moves, result) like chess_pgn.readGames
+    with open(path) as file:
+        for line in file:
+            moves = line.split()
+            if moves:
+                yield {}, moves, "*"
+
+
+def readGames(paths):
+    # yields (game number, tags, moves, result) from every file in turn
+    number = 0
+    for path in paths:
+        games = cp.readGames(path) if path.lower().endswith(".pgn") else readMoveLogs(path)
+        for tags, moves, result in games:
+            number += 1
+            yield number, tags, moves, result
+
+# %% --------------------------------------------------------------------------
+# Analysing a game
+# -----------------------------------------------------------------------------
+
+
+def centipawns(score):
+    return int(round(max(-SCORE_CAP, min(SCORE_CAP, score * 100))))
+
+
+def analysePosition(searcher, gs, timeLimit=None, maxNodes=None, maxDepth=None):
+    # (best move, score in pawns for the side to move), no move if the game is over
+    validMoves = gs.getValidMoves()
+    if not validMoves:
+        return None, -cc.CHECKMATE if gs.checkmate else cc.STALEMATE
+    bestMove, score, _ = searcher.searchPosition(gs, validMoves, timeLimit, maxNodes, maxDepth)
+    return bestMove, score
+
+
+def analyseGame(game, searcher=None, timeLimit=None, maxNodes=ANALYSIS_NODES, maxDepth=None):
+    # a record for each move and one for the whole game. Each position is searched once, its score
+    # is the best for the move from it and, turned round, the score of the move that led to it
+    number, tags, moves, result = game
+    if searcher is None:
+        searcher = cc.Searcher()
+    searcher.newGame()
+    start = time.perf_counter()
+    nodes = 0
+    gs = ce.createGameState(ANALYSIS_BACKEND)
+    gs.loadFEN(tags.get("FEN", ce.STARTING_FEN))
+    records = []
+    losses = {"w": [], "b": []}
+    counts = {"w": {flag: 0 for _, flag in FLAGS}, "b": {flag: 0 for _, flag in FLAGS}}
+    error = None
+
+    bestMove, bestScore = analysePosition(searcher, gs, timeLimit, maxNodes, maxDepth)
+    nodes += searcher.nodes
+    for ply, text in enumerate(moves, 1):
+        try:
+            move = cp.parseMove(gs, text)
+        except ValueError as exception:
+            error = str(exception)  # the rest of the game can't be followed
+            break
+        colour = "w" if gs.whiteToMove else "b"
+        turnMultiplier = 1 if gs.whiteToMove else -1
+        gs.makeMove(move)
+        nextBest, nextScore = analysePosition(searcher, gs, timeLimit, maxNodes, maxDepth)
+        nodes += searcher.nodes
+        best = centipawns(bestScore)
+        played = best if bestMove is not None and move.code == bestMove.code else centipawns(-nextScore)
+        loss = max(0, best - played)
+        flag = next((name for threshold, name in FLAGS if loss >= threshold), None)
+        losses[colour].append(loss)
+        if flag is not None:
+            counts[colour][flag] += 1
+        records.append({"event": "move", "game": number, "ply": ply, "colour": colour, "move": moveNotation(move),
+                        "eval": turnMultiplier * best, "bestMove": moveNotation(bestMove) if bestMove else None,
+                        "bestScore": best, "playedScore": played, "cpLoss": loss, "flag": flag})
+        bestMove, bestScore = nextBest, nextScore
+
+    summary = {"event": "game", "game": number, "white": tags.get("White"), "black": tags.get("Black"),
+               "result": result, "plies": len(records),
+               "averageCpLoss": {colour: round(sum(loss) / len(loss), 1) if loss else 0
+                                 for colour, loss in losses.items()},
+               "blunders": {colour: count["blunder"] for colour, count in counts.items()},
+               "mistakes": {colour: count["mistake"] for colour, count in counts.items()},
+               "inaccuracies": {colour: count["inaccuracy"] for colour, count in counts.items()},
+               "nodes": nodes, "seconds": round(time.perf_counter() - start, 3)}
+    if error is not None:
+        summary["error"] = error
+    records.append(summary)
+    return records
+
+# %% --------------------------------------------------------------------------
+# Many games over a process pool
+# -----------------------------------------------------------------------------
+
+workerSearcher = None  # in a worker process, kept from game to game
+
+
+def initWorker(tablebaseDir=None, nnuePath=None):
+    global workerSearcher
+    workerSearcher = cc.Searcher()
+    if tablebaseDir is not None:
+        from Chess.src.chess_tablebase import Tablebases
+        workerSearcher.tablebases = Tablebases(tablebaseDir)
+    if nnuePath is not None:
+        from Chess.src.chess_nnue import Network
+        workerSearcher.evaluator = Network.load(nnuePath)
+
+
+def analyseGameTask(args):
+    game, timeLimit, maxNodes, maxDepth = args
+    return analyseGame(game, workerSearcher, timeLimit, maxNodes, maxDepth)
+
+
+def analyseGames(games, workers=1, timeLimit=None, maxNodes=ANALYSIS_NODES, maxDepth=None, tablebaseDir=None,
+                 nnuePath=None, inFlight=None):
+    # yields the records of each game in the order of games, which can be a generator of any length.
+    # Only inFlight games (a couple per worker by default) are read ahead of the results
+    if workers <= 1:
+        initWorker(tablebaseDir, nnuePath)
+        for game in games:
+            yield analyseGameTask((game, timeLimit, maxNodes, maxDepth))
+        return
+    if inFlight is None:
+        inFlight = workers * IN_FLIGHT_PER_WORKER
+    with ProcessPoolExecutor(max_workers=workers, initializer=initWorker, initargs=(tablebaseDir, nnuePath)) as pool:
+        pending = deque()
+        for game in games:
+            pending.append(pool.submit(analyseGameTask, (game, timeLimit, maxNodes, maxDepth)))
+            if len(pending) >= inFlight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+# %% --------------------------------------------------------------------------
+# Command line
+# -----------------------------------------------------------------------------
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyse finished games, one JSON line per move and per game")
+    parser.add_argument("games", nargs="+", help="PGN files (.pgn) or move log files, one game per line")
+    parser.add_argument("--nodes", type=int, default=None, help="search budget per position, {} if no "
+                        "time or depth is given".format(ANALYSIS_NODES))
+    parser.add_argument("--time", type=float, default=None, help="seconds per position")
+    parser.add_argument("--depth", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", default=None, help="file to write, stdout if not given")
+    parser.add_argument("--tablebases", default=None, help="folder of chess_tablebase tables")
+    parser.add_argument("--nnue", default=None, help="chess_nnue weights to evaluate with")
+    args = parser.parse_args(argv)
+    maxNodes = args.nodes
+    if maxNodes is None and args.time is None and args.depth is None:
+        maxNodes = ANALYSIS_NODES
+
+    out = sys.stdout if args.output is None else open(args.output, "w")
+    start = time.perf_counter()
+    games = positions = 0
+    for records in analyseGames(readGames(args.games), args.workers, args.time, maxNodes, args.depth,
+                                args.tablebases, args.nnue):
+        for record in records:
+            out.write(json.dumps(record) + "\n")
+        out.flush()
+        games += 1
+        positions += len(records) - 1
+    elapsed = time.perf_counter() - start
+    if out is not sys.stdout:
+        out.close()
+    print("{} games, {} moves in {:.1f}s, {:.2f} games/s, {:.1f} moves/s".format(
+        games, positions, elapsed, games / elapsed if elapsed else 0, positions / elapsed if elapsed else 0),
+        file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
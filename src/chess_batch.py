@@ -0,0 +1,282 @@
+"""
+chess_batch.py
+
+Works on many positions at once with NumPy: material scores, attack maps and
+legal move counts for N positions in a handful of array operations, for
+labelling large position sets instead of looping over GameState objects.
+
+A batch is N x 64 int8 boards (square index row * 8 + col, white pieces
+positive P=1 N=2 B=3 R=4 Q=5 K=6, black negative, 0 empty) plus arrays for
+side to move, castle rights (same 4 bit mask as GameState.castleRights) and
+enpassant square (-1 for none).
+"""
+
+__date__ = "2026-10-18"
+__author__ = "WilliamGasson"
+__version__ = "0.1"
+
+
+# %% --------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import numpy as np
+
+import Chess.src.chess_engine as ce
+from Chess.src.chess_computer import pieceScore
+
+# %% --------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+PIECE_CODES = {"P": 1, "N": 2, "B": 3, "R": 4, "Q": 5, "K": 6}
+CODE_PIECES = {code: piece for piece, code in PIECE_CODES.items()}
+# value of each code 0-6 so material is a lookup on the absolute code
+CODE_VALUES = np.array([0] + [pieceScore[CODE_PIECES[code]] for code in range(1, 7)], dtype=np.int32)
+
+ORTHOGONAL = ((-1, 0), (0, -1), (1, 0), (0, 1))
+DIAGONAL = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+
+# %% --------------------------------------------------------------------------
+# Converting to and from GameState
+# -----------------------------------------------------------------------------
+
+
+class PositionBatch:
+    def __init__(self, boards, whiteToMove, castleRights=None, enpassant=None):
+        self.boards = np.asarray(boards, dtype=np.int8).reshape(-1, 64)
+        n = len(self.boards)
+        self.whiteToMove = np.asarray(whiteToMove, dtype=bool).reshape(n)
+        self.castleRights = np.zeros(n, np.uint8) if castleRights is None else np.asarray(castleRights, np.uint8)
+        self.enpassant = np.full(n, -1, np.int8) if enpassant is None else np.asarray(enpassant, np.int8)
+
+    def __len__(self):
+        return len(self.boards)
+
+    @staticmethod
+    def fromGameStates(gameStates):
+        gameStates = list(gameStates)
+        boards = np.zeros((len(gameStates), 64), np.int8)
+        for i, gs in enumerate(gameStates):
+            for r in range(8):
+                for c in range(8):
+                    piece = gs.board[r][c]
+                    if piece != "--":
+                        boards[i, r * 8 + c] = PIECE_CODES[piece[1]] if piece[0] == "w" else -PIECE_CODES[piece[1]]
+        return PositionBatch(boards,
+                             [gs.whiteToMove for gs in gameStates],
+                             [gs.castleRights for gs in gameStates],
+                             [gs.enpassantPossible[0] * 8 + gs.enpassantPossible[1] if gs.enpassantPossible != () else -1
+                              for gs in gameStates])
+
+    @staticmethod
+    def fromFENs(fens):
+        gs = ce.GameState()
+        gs.moveCacheSize = 0
+        states = []
+        for fen in fens:
+            gs.loadFEN(fen)
+            states.append(PositionBatch.fromGameStates([gs]))
+        return PositionBatch(np.concatenate([b.boards for b in states]),
+                             np.concatenate([b.whiteToMove for b in states]),
+                             np.concatenate([b.castleRights for b in states]),
+                             np.concatenate([b.enpassant for b in states]))
+
+    def getFEN(self, i):
+        ranks = []
+        for r in range(8):
+            rank = ""
+            empty = 0
+            for code in self.boards[i, r * 8:r * 8 + 8]:
+                if code == 0:
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                piece = CODE_PIECES[abs(int(code))]
+                rank += piece if code > 0 else piece.lower()
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        rights = int(self.castleRights[i])
+        castle = "".join(char for char, right in (("K", ce.WKS), ("Q", ce.WQS), ("k", ce.BKS), ("q", ce.BQS))
+                         if rights & right)
+        enpassant = "-"
+        if self.enpassant[i] >= 0:
+            r, c = ce.SQUARES[int(self.enpassant[i])]
+            enpassant = ce.Move.colsToFiles[c] + ce.Move.rowsToRanks[r]
+        return "{} {} {} {} 0 1".format("/".join(ranks), "w" if self.whiteToMove[i] else "b", castle or "-", enpassant)
+
+# %% --------------------------------------------------------------------------
+# Array helpers, everything works on N x 8 x 8 boolean masks
+# -----------------------------------------------------------------------------
+
+
+def shift(mask, dr, dc):
+    # move every set square by (dr, dc), squares pushed off the board are dropped
+    out = np.zeros_like(mask)
+    out[:, max(dr, 0):8 + min(dr, 0), max(dc, 0):8 + min(dc, 0)] = \
+        mask[:, max(-dr, 0):8 + min(-dr, 0), max(-dc, 0):8 + min(-dc, 0)]
+    return out
+
+
+def rowMask(row):
+    mask = np.zeros((1, 8, 8), bool)
+    mask[0, row] = True
+    return mask
+
+
+def sideBoards(batch, white):
+    # boards flipped so the pieces of the chosen side are positive, white is a bool per position
+    sign = np.where(white, 1, -1).astype(np.int8)
+    return batch.boards.reshape(-1, 8, 8) * sign[:, None, None]
+
+
+def attacks(pieces, occupied, white):
+    # squares attacked by the positive pieces, pawns move up the board for white and down for black
+    attacked = np.zeros(pieces.shape, bool)
+    pawns = pieces == 1
+    up = shift(pawns, -1, -1) | shift(pawns, -1, 1)
+    down = shift(pawns, 1, -1) | shift(pawns, 1, 1)
+    attacked |= np.where(white[:, None, None], up, down)
+    for dr, dc in KNIGHT_OFFSETS:
+        attacked |= shift(pieces == 2, dr, dc)
+    for dr, dc in ORTHOGONAL + DIAGONAL:
+        attacked |= shift(pieces == 6, dr, dc)
+    empty = ~occupied
+    for directions, sliders in ((ORTHOGONAL, (pieces == 4) | (pieces == 5)),
+                                (DIAGONAL, (pieces == 3) | (pieces == 5))):
+        for dr, dc in directions:
+            ray = sliders
+            for _ in range(7):
+                ray = shift(ray, dr, dc)
+                attacked |= ray
+                ray = ray & empty  # carry on only through empty squares
+                if not ray.any():
+                    break
+    return attacked
+
+# %% --------------------------------------------------------------------------
+# Batched scoring and counting
+# -----------------------------------------------------------------------------
+
+
+def scoreMaterial(batch):
+    # same as chess_computer.scoreMaterial for every board, positive is good for white
+    boards = batch.boards.astype(np.int32)
+    return (CODE_VALUES[np.abs(boards)] * np.sign(boards)).sum(axis=1)
+
+
+def attackMaps(batch, white=None):
+    # N x 64 squares attacked by white (or the side given per position), defaults to the side to move
+    white = batch.whiteToMove if white is None else np.broadcast_to(np.asarray(white, bool), (len(batch),))
+    pieces = sideBoards(batch, white)
+    return attacks(pieces, pieces != 0, white).reshape(-1, 64)
+
+
+def inCheck(batch):
+    us = sideBoards(batch, batch.whiteToMove)
+    enemyAttacks = attacks(-us, us != 0, ~batch.whiteToMove)
+    return (enemyAttacks & (us == 6)).any(axis=(1, 2))
+
+
+def hasPin(us):
+    # any piece of the side to move pinned to its king by a slider, walks out from the king in each direction
+    king = us == 6
+    pinned = np.zeros(len(us), bool)
+    for directions, sliderCodes in ((ORTHOGONAL, (-4, -5)), (DIAGONAL, (-3, -5))):
+        for dr, dc in directions:
+            ray = king
+            alliesSeen = np.zeros(len(us), np.int8)
+            done = np.zeros(len(us), bool)
+            for _ in range(7):
+                ray = shift(ray, dr, dc)
+                onBoard = ray.any(axis=(1, 2))
+                piece = np.where(ray, us, 0).sum(axis=(1, 2))
+                active = ~done & onBoard
+                enemySlider = np.isin(piece, sliderCodes)
+                pinned |= active & (alliesSeen == 1) & enemySlider
+                alliesSeen += (active & (piece > 0)).astype(np.int8)
+                done |= ~onBoard | (active & (piece < 0)) | (alliesSeen > 1)
+                if done.all():
+                    break
+    return pinned
+
+
+def canCaptureEnpassant(batch, pawns):
+    # positions where a pawn of the side to move stands beside the pawn that can be taken enpassant,
+    # like chess_tablebase.canCaptureEnpassant. An enpassant square with no such pawn changes nothing
+    rows = np.arange(len(batch))
+    squares = np.maximum(batch.enpassant, 0).astype(np.int64)
+    row = np.clip(squares // 8 + np.where(batch.whiteToMove, 1, -1), 0, 7)
+    col = squares % 8
+    left = pawns[rows, row, np.maximum(col - 1, 0)] & (col > 0)
+    right = pawns[rows, row, np.minimum(col + 1, 7)] & (col < 7)
+    return (batch.enpassant >= 0) & (left | right)
+
+
+def legalMoveCounts(batch):
+    # number of legal moves for the side to move in every position. Positions in check, with a pinned
+    # piece or with an enpassant capture on the board are rare and are counted one at a time with GameState
+    white = batch.whiteToMove
+    us = sideBoards(batch, white)
+    own = us > 0
+    occupied = us != 0
+    empty = ~occupied
+    them = us < 0
+    king = us == 6
+    enemyAttacks = attacks(-us, occupied & ~king, ~white)  # king lifted so it can't step back along a ray
+
+    counts = np.zeros(len(batch), np.int64)
+    # king
+    kingTargets = np.zeros_like(own)
+    for dr, dc in ORTHOGONAL + DIAGONAL:
+        kingTargets |= shift(king, dr, dc)
+    counts += (kingTargets & ~own & ~enemyAttacks).sum(axis=(1, 2))
+    # knights
+    for dr, dc in KNIGHT_OFFSETS:
+        counts += (shift(us == 2, dr, dc) & ~own).sum(axis=(1, 2))
+    # sliders, rays of two pieces in the same direction can't overlap as the first blocks the second
+    for directions, sliders in ((ORTHOGONAL, (us == 4) | (us == 5)), (DIAGONAL, (us == 3) | (us == 5))):
+        for dr, dc in directions:
+            ray = sliders
+            for _ in range(7):
+                ray = shift(ray, dr, dc)
+                counts += (ray & ~own).sum(axis=(1, 2))
+                ray = ray & empty
+                if not ray.any():
+                    break
+    # pawns, a move onto the back row counts once for each piece it can promote to
+    pawns = us == 1
+    pawnMoves = []
+    for dr, doubleFrom, backRow in ((-1, 5, 0), (1, 2, 7)):  # white moves up the board, black down
+        single = shift(pawns, dr, 0) & empty
+        double = shift(single & rowMask(doubleFrom), dr, 0) & empty
+        captures = [shift(pawns, dr, dc) & them for dc in (-1, 1)]
+        moved = single.sum(axis=(1, 2)) + double.sum(axis=(1, 2)) + sum(mask.sum(axis=(1, 2)) for mask in captures)
+        promoting = sum((mask & rowMask(backRow)).sum(axis=(1, 2)) for mask in [single] + captures)
+        pawnMoves.append(moved + (len(ce.PROMOTION_PIECES) - 1) * promoting)
+    counts += np.where(white, pawnMoves[0], pawnMoves[1])
+    # castling, needs the right, empty squares between and the king not crossing an attacked square
+    homeRow = np.where(white, 7, 0)
+    rows = np.arange(len(batch))
+    kingSide = np.where(white, ce.WKS, ce.BKS)
+    queenSide = np.where(white, ce.WQS, ce.BQS)
+    canKingSide = ((batch.castleRights & kingSide) != 0) & empty[rows, homeRow, 5] & empty[rows, homeRow, 6] & \
+        ~enemyAttacks[rows, homeRow, 5] & ~enemyAttacks[rows, homeRow, 6]
+    canQueenSide = ((batch.castleRights & queenSide) != 0) & empty[rows, homeRow, 3] & empty[rows, homeRow, 2] & \
+        empty[rows, homeRow, 1] & ~enemyAttacks[rows, homeRow, 3] & ~enemyAttacks[rows, homeRow, 2]
+    counts += canKingSide.astype(np.int64) + canQueenSide.astype(np.int64)
+
+    # the rest go through GameState
+    checked = (enemyAttacks & king).any(axis=(1, 2))
+    irregular = checked | hasPin(us) | canCaptureEnpassant(batch, pawns)
+    if irregular.any():
+        gs = ce.GameState()
+        gs.moveCacheSize = 0
+        for i in np.flatnonzero(irregular):
+            gs.loadFEN(batch.getFEN(i))
+            counts[i] = len(gs.getValidMoveCodes())
+    return counts
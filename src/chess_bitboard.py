@@ -0,0 +1,532 @@
+"""
+chess_bitboard.py
+
+Bitboard backend for the game state. Each piece type and colour is stored as a
+64 bit integer with a 64 square mailbox beside it, moves are generated as codes
+from precomputed attack tables and played straight on the bitboards.
+
+Square index is row * 8 + col, so square 0 is a8 and square 63 is h1 which
+matches the rows and cols used by the board list and Move.
+"""
+
+__date__ = "2026-10-18"
+__author__ = "WilliamGasson"
+__version__ = "0.1"
+
+
+# %% --------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+from array import array
+
+from Chess.src.chess_engine import GameState, Move, SQUARES, MOVE_PROMOTION, MOVE_ENPASSANT, MOVE_CASTLE, \
+    PROMOTION_PIECES, WKS, BKS, WQS, BQS, CASTLE_RIGHTS_KEPT, MATERIAL_VALUES, PHASE_WEIGHTS, PIECE_SQUARE_MG, \
+    PIECE_SQUARE_EG, ZOBRIST_PIECES, ZOBRIST_BLACK_TO_MOVE, ZOBRIST_CASTLE, ZOBRIST_ENPASSANT
+
+# %% --------------------------------------------------------------------------
+# Precomputed tables
+# -----------------------------------------------------------------------------
+
+PIECES = ("wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK")
+FULL = (1 << 64) - 1
+
+# the engine's zobrist and piece square tables by square index instead of row and col
+ZOBRIST_SQUARES = {piece: [ZOBRIST_PIECES[piece][r][c] for r, c in SQUARES] for piece in PIECES}
+PST_MIDGAME = {piece: [PIECE_SQUARE_MG[piece][r][c] for r, c in SQUARES] for piece in PIECES}
+PST_ENDGAME = {piece: [PIECE_SQUARE_EG[piece][r][c] for r, c in SQUARES] for piece in PIECES}
+# rook from and to squares by the square the king lands on when castling
+CASTLE_ROOK_SQUARES = {62: (63, 61), 58: (56, 59), 6: (7, 5), 2: (0, 3)}
+
+# same order as checkForPinsAndChecks: 0-3 orthogonal, 4-7 diagonal
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1),
+              (-1, -1), (-1, 1), (1, -1), (1, 1))
+ROOK_DIRECTIONS = (0, 1, 2, 3)
+BISHOP_DIRECTIONS = (4, 5, 6, 7)
+# directions where the square index increases, so the nearest blocker is the lowest bit
+POSITIVE_DIRECTION = tuple(d[0] * 8 + d[1] > 0 for d in DIRECTIONS)
+
+
+def onBoard(r, c):
+    return 0 <= r < 8 and 0 <= c < 8
+
+
+def leaperAttacks(offsets):
+    table = []
+    for r, c in SQUARES:
+        attacks = 0
+        for dr, dc in offsets:
+            if onBoard(r + dr, c + dc):
+                attacks |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(attacks)
+    return table
+
+
+KNIGHT_ATTACKS = leaperAttacks(((-2, -1), (-2, 1), (-1, -2), (-1, 2),
+                                (1, -2), (1, 2), (2, -1), (2, 1)))
+KING_ATTACKS = leaperAttacks(((-1, -1), (-1, 0), (-1, 1), (0, -1),
+                              (0, 1), (1, -1), (1, 0), (1, 1)))
+# squares a pawn of that colour attacks from each square
+PAWN_ATTACKS = {"w": leaperAttacks(((-1, -1), (-1, 1))),
+                "b": leaperAttacks(((1, -1), (1, 1)))}
+
+# RAYS[d][sq] is every square from sq in direction d on an empty board
+RAYS = []
+for dr, dc in DIRECTIONS:
+    rays = []
+    for r, c in SQUARES:
+        ray = 0
+        for i in range(1, 8):
+            if not onBoard(r + dr * i, c + dc * i):
+                break
+            ray |= 1 << ((r + dr * i) * 8 + c + dc * i)
+        rays.append(ray)
+    RAYS.append(rays)
+
+ROOK_RAYS = [RAYS[0][sq] | RAYS[1][sq] | RAYS[2][sq] | RAYS[3][sq] for sq in range(64)]
+BISHOP_RAYS = [RAYS[4][sq] | RAYS[5][sq] | RAYS[6][sq] | RAYS[7][sq] for sq in range(64)]
+
+# BETWEEN[a][b] squares strictly between two aligned squares, LINE[a][b] the whole line through them
+BETWEEN = [[0] * 64 for _ in range(64)]
+LINE = [[0] * 64 for _ in range(64)]
+for a in range(64):
+    for d in range(8):
+        opposite = d + 2 if d in (0, 1) else d - 2 if d in (2, 3) else 11 - d
+        ray = RAYS[d][a]
+        while ray:
+            low = ray & -ray
+            b = low.bit_length() - 1
+            BETWEEN[a][b] = RAYS[d][a] & ~RAYS[d][b] & ~low
+            LINE[a][b] = RAYS[d][a] | RAYS[opposite][a] | (1 << a)
+            ray ^= low
+
+
+def slidingAttacks(sq, occupied, directions):
+    attacks = 0
+    for d in directions:
+        ray = RAYS[d][sq]
+        blockers = ray & occupied
+        if blockers:
+            if POSITIVE_DIRECTION[d]:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= RAYS[d][blocker]  # remove the squares behind the blocker
+        attacks |= ray
+    return attacks
+
+
+def slidingAttackTable(directions):
+    # like magic bitboards with a dict in place of the multiply, for each square the attacks for every
+    # occupancy of the squares that can block (the last square of a ray never blocks anything)
+    masks = []
+    tables = []
+    for sq in range(64):
+        mask = 0
+        for d in directions:
+            ray = RAYS[d][sq]
+            if ray:
+                mask |= ray ^ (1 << (ray.bit_length() - 1) if POSITIVE_DIRECTION[d] else ray & -ray)
+        attacks = {}
+        subset = 0
+        while True:  # every subset of the mask
+            attacks[subset] = slidingAttacks(sq, subset, directions)
+            subset = (subset - mask) & mask
+            if subset == 0:
+                break
+        masks.append(mask)
+        tables.append(attacks)
+    return masks, tables
+
+
+ROOK_MASKS, ROOK_TABLES = slidingAttackTable(ROOK_DIRECTIONS)
+BISHOP_MASKS, BISHOP_TABLES = slidingAttackTable(BISHOP_DIRECTIONS)
+
+
+def rookAttacks(sq, occupied):
+    return ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]]
+
+
+def bishopAttacks(sq, occupied):
+    return BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]]
+
+
+def addPawnCode(moves, code, moveType):
+    # a promotion is added once for each piece in PROMOTION_PIECES, queen first
+    if moveType:
+        moves.extend(code | moveType | piece << 14 for piece in range(len(PROMOTION_PIECES)))
+    else:
+        moves.append(code)
+
+
+# %% --------------------------------------------------------------------------
+# BitboardGameState class
+# -----------------------------------------------------------------------------
+
+
+class BitboardGameState(GameState):
+    # same makeMove/undoMove/getValidMoves interface as GameState. The bitboards and a 64 square mailbox
+    # are the position, moves are played on them straight from their codes and the 8x8 board list is
+    # only rebuilt from the mailbox when something reads it (drawing, FEN, tablebases)
+
+    def __init__(self):
+        super().__init__()
+        self.syncBitboards()
+
+    @property
+    def board(self):
+        if self.boardStale:
+            rows = self.boardRows
+            for sq, piece in enumerate(self.mailbox):
+                rows[sq >> 3][sq & 7] = piece
+            self.boardStale = False
+        return self.boardRows
+
+    @board.setter
+    def board(self, board):
+        self.boardRows = board
+        self.boardStale = False
+
+    def syncBitboards(self):
+        # rebuild every bitboard and the mailbox from the board list
+        self.mailbox = [self.boardRows[r][c] for r, c in SQUARES]
+        self.pieceBoards = {piece: 0 for piece in PIECES}
+        self.colourBoards = {"w": 0, "b": 0}
+        for sq, piece in enumerate(self.mailbox):
+            if piece != "--":
+                self.pieceBoards[piece] |= 1 << sq
+                self.colourBoards[piece[0]] |= 1 << sq
+        self.occupied = self.colourBoards["w"] | self.colourBoards["b"]
+
+    def loadFEN(self, fen):
+        super().loadFEN(fen)
+        self.syncBitboards()
+
+    def makeMove(self, move):
+        self.makeMoveCode(move.code, move)
+
+    def makeMoveCode(self, code, move=None):
+        # the Move for the log is only built from the code if the caller didn't have one
+        startSq = code & 63
+        endSq = code >> 6 & 63
+        moveType = code & 0x3000
+        pieceMoved = self.mailbox[startSq]
+        colour = pieceMoved[0]
+        capturedSq = (startSq & 56 | endSq & 7) if moveType == MOVE_ENPASSANT else endSq
+        pieceCaptured = self.mailbox[capturedSq]
+        placed = colour + PROMOTION_PIECES[code >> 14] if moveType == MOVE_PROMOTION else pieceMoved
+        if move is None:
+            move = Move.fromPieces(code, pieceMoved, pieceCaptured)
+        self.saveUndoState()
+
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_SQUARES[pieceMoved][startSq] ^ \
+            ZOBRIST_SQUARES[placed][endSq]
+        if pieceCaptured != "--":
+            key ^= ZOBRIST_SQUARES[pieceCaptured][capturedSq]
+        elif moveType == MOVE_CASTLE:
+            rookFrom, rookTo = CASTLE_ROOK_SQUARES[endSq]
+            key ^= ZOBRIST_SQUARES[colour + "R"][rookFrom] ^ ZOBRIST_SQUARES[colour + "R"][rookTo]
+        self.toggleMove(startSq, endSq, capturedSq, pieceMoved, pieceCaptured, placed, moveType, 1)
+
+        if pieceMoved == "wK":
+            self.whiteKingLocation = SQUARES[endSq]
+        elif pieceMoved == "bK":
+            self.blackKingLocation = SQUARES[endSq]
+        if pieceMoved[1] == "P" or pieceCaptured != "--":
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        if self.enpassantPossible != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        if pieceMoved[1] == "P" and abs(endSq - startSq) == 16:
+            self.enpassantPossible = SQUARES[(startSq + endSq) >> 1]
+            key ^= ZOBRIST_ENPASSANT[startSq & 7]
+        else:
+            self.enpassantPossible = ()
+        castleRights = self.castleRights & CASTLE_RIGHTS_KEPT[startSq] & CASTLE_RIGHTS_KEPT[endSq]
+        if castleRights != self.castleRights:
+            key ^= ZOBRIST_CASTLE[self.castleRights] ^ ZOBRIST_CASTLE[castleRights]
+            self.castleRights = castleRights
+        self.zobristKey = key
+        self.whiteToMove = not self.whiteToMove
+        self.moveLog.append(move)
+        if self.accumulator is not None:
+            self.accumulator.push(move, placed)
+
+    def undoMove(self):
+        if len(self.moveLog) != 0:
+            move = self.moveLog.pop()
+            code = move.code
+            startSq = code & 63
+            endSq = code >> 6 & 63
+            moveType = code & 0x3000
+            capturedSq = (startSq & 56 | endSq & 7) if moveType == MOVE_ENPASSANT else endSq
+            placed = self.mailbox[endSq]  # promoted piece if it was a promotion
+            self.toggleMove(startSq, endSq, capturedSq, move.pieceMoved, move.pieceCaptured, placed, moveType, -1)
+            self.whiteToMove = not self.whiteToMove
+            if move.pieceMoved == "wK":
+                self.whiteKingLocation = SQUARES[startSq]
+            elif move.pieceMoved == "bK":
+                self.blackKingLocation = SQUARES[startSq]
+            self.restoreUndoState()
+            if self.accumulator is not None:
+                self.accumulator.pop()
+            self.checkmate = False
+            self.stalemate = False
+
+    def toggleMove(self, startSq, endSq, capturedSq, pieceMoved, pieceCaptured, placed, moveType, sign):
+        # sign is 1 to make the move and -1 to undo it. The bitboards are xored so the same change does
+        # both, the mailbox is set and the scores go up or down like GameState.updateScores
+        pieceBoards = self.pieceBoards
+        colourBoards = self.colourBoards
+        mailbox = self.mailbox
+        colour = pieceMoved[0]
+        startBoard = 1 << startSq
+        endBoard = 1 << endSq
+        pieceBoards[pieceMoved] ^= startBoard
+        pieceBoards[placed] ^= endBoard
+        colourBoards[colour] ^= startBoard | endBoard
+        if sign > 0:
+            mailbox[startSq] = "--"
+            mailbox[capturedSq] = "--"  # only differs from the end square for enpassant
+            mailbox[endSq] = placed
+        else:
+            mailbox[endSq] = "--"
+            mailbox[capturedSq] = pieceCaptured
+            mailbox[startSq] = pieceMoved
+        self.boardStale = True
+
+        midgame = PST_MIDGAME[placed][endSq] - PST_MIDGAME[pieceMoved][startSq]
+        endgame = PST_ENDGAME[placed][endSq] - PST_ENDGAME[pieceMoved][startSq]
+        if moveType == MOVE_PROMOTION:
+            self.material[colour] += sign * (MATERIAL_VALUES[placed[1]] - MATERIAL_VALUES["P"])
+            self.nonPawnMaterial[colour] += sign * MATERIAL_VALUES[placed[1]]
+            self.gamePhase += sign * PHASE_WEIGHTS[placed[1]]
+        elif moveType == MOVE_CASTLE:
+            rook = colour + "R"
+            rookFrom, rookTo = CASTLE_ROOK_SQUARES[endSq]
+            rookBoard = (1 << rookFrom) | (1 << rookTo)
+            pieceBoards[rook] ^= rookBoard
+            colourBoards[colour] ^= rookBoard
+            if sign > 0:
+                mailbox[rookFrom], mailbox[rookTo] = "--", rook
+            else:
+                mailbox[rookFrom], mailbox[rookTo] = rook, "--"
+            midgame += PST_MIDGAME[rook][rookTo] - PST_MIDGAME[rook][rookFrom]
+            endgame += PST_ENDGAME[rook][rookTo] - PST_ENDGAME[rook][rookFrom]
+        self.pstMidgame[colour] += sign * midgame
+        self.pstEndgame[colour] += sign * endgame
+
+        if pieceCaptured != "--":
+            enemy = pieceCaptured[0]
+            capturedBoard = 1 << capturedSq
+            pieceBoards[pieceCaptured] ^= capturedBoard
+            colourBoards[enemy] ^= capturedBoard
+            self.material[enemy] -= sign * MATERIAL_VALUES[pieceCaptured[1]]
+            if pieceCaptured[1] != "P":
+                self.nonPawnMaterial[enemy] -= sign * MATERIAL_VALUES[pieceCaptured[1]]
+            self.pstMidgame[enemy] -= sign * PST_MIDGAME[pieceCaptured][capturedSq]
+            self.pstEndgame[enemy] -= sign * PST_ENDGAME[pieceCaptured][capturedSq]
+            self.gamePhase -= sign * PHASE_WEIGHTS[pieceCaptured[1]]
+        self.occupied = colourBoards["w"] | colourBoards["b"]
+
+    def movePieces(self, code):
+        mailbox = self.mailbox
+        if code & 0x3000 == MOVE_ENPASSANT:
+            return mailbox[code & 63], "bP" if self.whiteToMove else "wP"
+        return mailbox[code & 63], mailbox[code >> 6 & 63]
+
+    def attackersTo(self, sq, occupied):
+        # pieces of both colours attacking sq given the occupancy
+        pb = self.pieceBoards
+        return (KNIGHT_ATTACKS[sq] & (pb["wN"] | pb["bN"])) | \
+            (KING_ATTACKS[sq] & (pb["wK"] | pb["bK"])) | \
+            (PAWN_ATTACKS["w"][sq] & pb["bP"]) | (PAWN_ATTACKS["b"][sq] & pb["wP"]) | \
+            (ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]] & (pb["wR"] | pb["bR"] | pb["wQ"] | pb["bQ"])) | \
+            (BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]] & (pb["wB"] | pb["bB"] | pb["wQ"] | pb["bQ"]))
+
+    def squareUnderAttack(self, r, c):
+        enemyColour = "b" if self.whiteToMove else "w"
+        return self.attackersTo(r * 8 + c, self.occupied) & self.colourBoards[enemyColour] != 0
+
+    def incheck(self):
+        allyColour, enemyColour = ("w", "b") if self.whiteToMove else ("b", "w")
+        kingSq = self.pieceBoards[allyColour + "K"].bit_length() - 1
+        return self.attackersTo(kingSq, self.occupied) & self.colourBoards[enemyColour] != 0
+
+    def pinnedPieces(self, kingSq, us, enemyColour):
+        # returns a dict of pinned square -> line the piece may still move along
+        pb = self.pieceBoards
+        pins = {}
+        snipers = (ROOK_RAYS[kingSq] & (pb[enemyColour + "R"] | pb[enemyColour + "Q"])) | \
+            (BISHOP_RAYS[kingSq] & (pb[enemyColour + "B"] | pb[enemyColour + "Q"]))
+        while snipers:
+            low = snipers & -snipers
+            sniperSq = low.bit_length() - 1
+            snipers ^= low
+            blockers = BETWEEN[kingSq][sniperSq] & self.occupied
+            if blockers and blockers & (blockers - 1) == 0 and blockers & us:  # exactly one allied piece
+                pins[blockers.bit_length() - 1] = LINE[kingSq][sniperSq]
+        return pins
+
+    def generateValidMoves(self):
+        # legal moves straight from the bitboards as 16 bit codes, no Move objects are made
+        moves = self.generateMoveCodes()
+        if len(moves) == 0:
+            if self.inCheck:
+                self.checkmate = True
+            else:
+                self.stalemate = True
+        else:
+            self.checkmate = False
+            self.stalemate = False
+
+        return moves
+
+    def generateMoveCodes(self, captures=True, quiets=True, castles=True, fromMask=FULL):
+        # captures includes pawn pushes that promote, quiets is everything else except castling.
+        # Only pieces on the squares of fromMask are moved
+        moves = array("H")
+        pb = self.pieceBoards
+        allyColour = "w" if self.whiteToMove else "b"
+        enemyColour = "b" if self.whiteToMove else "w"
+        us = self.colourBoards[allyColour]
+        them = self.colourBoards[enemyColour]
+        occupied = self.occupied
+
+        kingBoard = pb[allyColour + "K"]
+        kingSq = kingBoard.bit_length() - 1
+        checkers = self.attackersTo(kingSq, occupied) & them
+        self.inCheck = checkers != 0
+
+        # king moves, the king is removed so it can't hide behind itself from a slider
+        withoutKing = occupied ^ kingBoard
+        wanted = (them if captures else 0) | (~occupied & FULL if quiets else 0)
+        targets = KING_ATTACKS[kingSq] & wanted if kingBoard & fromMask else 0
+        while targets:
+            low = targets & -targets
+            targets ^= low
+            endSq = low.bit_length() - 1
+            if not self.attackersTo(endSq, withoutKing) & them:
+                moves.append(kingSq | endSq << 6)
+
+        if checkers & (checkers - 1) == 0:  # zero or one checker, other pieces can move
+            if checkers:
+                checkSq = checkers.bit_length() - 1
+                evasionMask = BETWEEN[kingSq][checkSq] | checkers  # block or capture
+            else:
+                evasionMask = FULL
+            pins = self.pinnedPieces(kingSq, us, enemyColour)
+            targetMask = wanted & evasionMask
+
+            for piece, attackFunction in ((allyColour + "N", None),
+                                          (allyColour + "B", bishopAttacks),
+                                          (allyColour + "R", rookAttacks),
+                                          (allyColour + "Q", None)):
+                pieces = pb[piece] & fromMask
+                while pieces:
+                    low = pieces & -pieces
+                    pieces ^= low
+                    sq = low.bit_length() - 1
+                    if attackFunction is not None:
+                        targets = attackFunction(sq, occupied)
+                    elif piece[1] == "N":
+                        if sq in pins:  # a pinned knight can never move
+                            continue
+                        targets = KNIGHT_ATTACKS[sq]
+                    else:
+                        targets = rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)
+                    targets &= targetMask & pins.get(sq, FULL)
+                    while targets:
+                        low = targets & -targets
+                        targets ^= low
+                        moves.append(sq | (low.bit_length() - 1) << 6)
+
+            self.getPawnMovesBitboard(allyColour, enemyColour, kingSq, pins, evasionMask, moves, captures, quiets,
+                                      fromMask)
+
+            if castles and not checkers and kingBoard & fromMask:
+                self.getCastleMovesBitboard(kingSq, enemyColour, moves)
+
+        return moves
+
+    def getCaptureCodes(self, includePromotions=False):
+        moves = self.generateMoveCodes(quiets=False, castles=False)
+        if not includePromotions:
+            moves = array("H", [code for code in moves if self.movePieces(code)[1] != "--"])
+        return moves
+
+    def getQuietCodes(self):
+        return self.generateMoveCodes(captures=False, castles=False)
+
+    def getCastleCodes(self):
+        return self.generateMoveCodes(captures=False, quiets=False)
+
+    def getCodesFrom(self, r, c):
+        return self.generateMoveCodes(castles=False, fromMask=1 << (r * 8 + c))
+
+    def getPawnMovesBitboard(self, allyColour, enemyColour, kingSq, pins, evasionMask, moves, captures=True, quiets=True,
+                             fromMask=FULL):
+        them = self.colourBoards[enemyColour]
+        occupied = self.occupied
+        if allyColour == "w":
+            moveAmount, startRow, backRow = -8, 6, 0
+        else:
+            moveAmount, startRow, backRow = 8, 1, 7
+        attackTable = PAWN_ATTACKS[allyColour]
+        enpassantBoard = 0
+        if self.enpassantPossible != ():
+            enpassantBoard = 1 << (self.enpassantPossible[0] * 8 + self.enpassantPossible[1])
+
+        pawns = self.pieceBoards[allyColour + "P"] & fromMask
+        while pawns:
+            pawnBoard = pawns & -pawns
+            pawns ^= pawnBoard
+            sq = pawnBoard.bit_length() - 1
+            allowed = evasionMask & pins.get(sq, FULL)
+            moveType = MOVE_PROMOTION if (sq >> 3) + moveAmount // 8 == backRow else 0
+
+            # pushes, a push that promotes counts with the captures
+            endSq = sq + moveAmount
+            if not occupied & (1 << endSq):
+                if allowed & (1 << endSq) and (captures if moveType else quiets):
+                    addPawnCode(moves, sq | endSq << 6, moveType)
+                if sq >> 3 == startRow and quiets:
+                    endSq += moveAmount
+                    if not occupied & (1 << endSq) and allowed & (1 << endSq):
+                        moves.append(sq | endSq << 6)
+            if not captures:
+                continue
+
+            # captures
+            targets = attackTable[sq] & them & allowed
+            while targets:
+                low = targets & -targets
+                targets ^= low
+                addPawnCode(moves, sq | (low.bit_length() - 1) << 6, moveType)
+
+            # enpassant, check the king directly as two pawns leave the rank at once
+            if attackTable[sq] & enpassantBoard:
+                endSq = enpassantBoard.bit_length() - 1
+                capturedBoard = 1 << (endSq - moveAmount)
+                afterOccupied = (occupied ^ pawnBoard ^ capturedBoard) | enpassantBoard
+                self.pieceBoards[enemyColour + "P"] ^= capturedBoard
+                attacked = self.attackersTo(kingSq, afterOccupied) & (them ^ capturedBoard)
+                self.pieceBoards[enemyColour + "P"] ^= capturedBoard
+                if not attacked:
+                    moves.append(sq | endSq << 6 | MOVE_ENPASSANT)
+
+    def getCastleMovesBitboard(self, kingSq, enemyColour, moves):
+        # only called when not in check
+        occupied = self.occupied
+        them = self.colourBoards[enemyColour]
+        if self.castleRights & (WKS if self.whiteToMove else BKS):
+            if not occupied & ((1 << (kingSq + 1)) | (1 << (kingSq + 2))) and \
+                    not self.attackersTo(kingSq + 1, occupied) & them and \
+                    not self.attackersTo(kingSq + 2, occupied) & them:
+                moves.append(kingSq | (kingSq + 2) << 6 | MOVE_CASTLE)
+        if self.castleRights & (WQS if self.whiteToMove else BQS):
+            if not occupied & ((1 << (kingSq - 1)) | (1 << (kingSq - 2)) | (1 << (kingSq - 3))) and \
+                    not self.attackersTo(kingSq - 1, occupied) & them and \
+                    not self.attackersTo(kingSq - 2, occupied) & them:
+                moves.append(kingSq | (kingSq - 2) << 6 | MOVE_CASTLE)
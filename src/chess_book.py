@@ -0,0 +1,181 @@
+"""
+chess_book.py
+
+Opening book: moves played from each position in a collection of games, stored as a
+sorted binary file that is memory mapped and binary searched so a lookup costs
+microseconds and no search is needed in the opening.
+
+File format : 8 byte header b"CHESSBK1", then 12 byte records of zobrist key (8 bytes),
+              move code (2 bytes) and weight (2 bytes), little endian, sorted by key
+
+Usage : python -m Chess.src.chess_book build games.pgn book.bin --plies 20
+        python -m Chess.src.chess_book probe book.bin "<fen>"
+"""
+
+__date__ = "2026-10-18"
+__author__ = "WilliamGasson"
+__version__ = "0.1"
+
+
+# %% --------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import argparse
+import mmap
+import random
+import struct
+from collections import Counter
+
+import Chess.src.chess_engine as ce
+import Chess.src.chess_pgn as cp
+from Chess.src.chess_perft import moveNotation
+
+# %% --------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+BOOK_HEADER = b"CHESSBK1"
+RECORD = struct.Struct("<QHH")  # zobrist key, move code, weight
+MAX_WEIGHT = 0xFFFF
+BOOK_PLIES = 20  # moves into each game that go in the book
+WIN_WEIGHT, DRAW_WEIGHT, LOSS_WEIGHT = 2, 1, 0  # moves by the winner count more, the loser's not at all
+
+# %% --------------------------------------------------------------------------
+# Building a book from PGN
+# -----------------------------------------------------------------------------
+
+
+def countBookMoves(pgnPaths, plies=BOOK_PLIES):
+    # Counter of (zobrist key, move code) weighted by the result for the side that played it
+    counts = Counter()
+    gs = ce.GameState()
+    for path in pgnPaths:
+        for tags, moves, result in cp.readGames(path):
+            gs.loadFEN(tags.get("FEN", ce.STARTING_FEN))
+            for san in moves[:plies]:
+                try:
+                    move = cp.parseSAN(gs, san)
+                except ValueError:
+                    break  # rest of the game can't be followed
+                if result == "1/2-1/2":
+                    weight = DRAW_WEIGHT
+                elif result == ("1-0" if gs.whiteToMove else "0-1"):
+                    weight = WIN_WEIGHT
+                elif result in ("1-0", "0-1"):
+                    weight = LOSS_WEIGHT
+                else:
+                    weight = DRAW_WEIGHT  # unknown result
+                if weight:
+                    counts[gs.zobristKey, move.code] += weight
+                gs.makeMove(move)
+    return counts
+
+
+def writeBook(counts, path, minWeight=1):
+    records = sorted((key, code, min(weight, MAX_WEIGHT)) for (key, code), weight in counts.items()
+                     if weight >= minWeight)
+    with open(path, "wb") as file:
+        file.write(BOOK_HEADER)
+        for record in records:
+            file.write(RECORD.pack(*record))
+    return len(records)
+
+
+def buildBook(pgnPaths, path, plies=BOOK_PLIES, minWeight=1):
+    return writeBook(countBookMoves(pgnPaths, plies), path, minWeight)
+
+# %% --------------------------------------------------------------------------
+# Looking up moves
+# -----------------------------------------------------------------------------
+
+
+class OpeningBook:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(BOOK_HEADER)] != BOOK_HEADER:
+            self.close()
+            raise ValueError("{} is not an opening book".format(path))
+        self.records = (len(self.data) - len(BOOK_HEADER)) // RECORD.size
+
+    def close(self):
+        if getattr(self, "data", None) is not None:
+            self.data.close()
+            self.data = None
+        self.file.close()
+
+    def keyAt(self, i):
+        return struct.unpack_from("<Q", self.data, len(BOOK_HEADER) + i * RECORD.size)[0]
+
+    def lookup(self, key):
+        # [(move code, weight)] for the position, binary search for the first record with the key
+        low, high = 0, self.records
+        while low < high:
+            middle = (low + high) // 2
+            if self.keyAt(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        offset = len(BOOK_HEADER) + low * RECORD.size
+        while offset < len(self.data):
+            recordKey, code, weight = RECORD.unpack_from(self.data, offset)
+            if recordKey != key:
+                break
+            entries.append((code, weight))
+            offset += RECORD.size
+        return entries
+
+    def pickMove(self, gs, validMoves=None, best=False):
+        # a book move for the position chosen at random by weight (or the heaviest), None if out of book
+        entries = self.lookup(gs.zobristKey)
+        if not entries:
+            return None
+        if validMoves is None:
+            validMoves = gs.getValidMoves()
+        moves = {move.code: move for move in validMoves}
+        choices = []
+        for code, weight in entries:
+            move = moves.get(code)
+            if move is not None:  # a key clash could give a move that isn't legal here
+                choices.append((move, weight))
+        if not choices:
+            return None
+        if best:
+            return max(choices, key=lambda choice: choice[1])[0]
+        return random.choices([move for move, _ in choices], [weight for _, weight in choices])[0]
+
+# %% --------------------------------------------------------------------------
+# Command line
+# -----------------------------------------------------------------------------
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and query opening books")
+    commands = parser.add_subparsers(dest="command", required=True)
+    buildParser = commands.add_parser("build", help="make a book from PGN files")
+    buildParser.add_argument("pgn", nargs="+")
+    buildParser.add_argument("book")
+    buildParser.add_argument("--plies", type=int, default=BOOK_PLIES)
+    buildParser.add_argument("--min-weight", type=int, default=1, help="drop moves seen less than this")
+    probeParser = commands.add_parser("probe", help="list the book moves of a position")
+    probeParser.add_argument("book")
+    probeParser.add_argument("fen", nargs="?", default="startpos")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        records = buildBook(args.pgn, args.book, args.plies, args.min_weight)
+        print("{} moves written to {}".format(records, args.book))
+    else:
+        book = OpeningBook(args.book)
+        gs = ce.GameState()
+        gs.loadFEN(ce.STARTING_FEN if args.fen == "startpos" else args.fen)
+        for code, weight in sorted(book.lookup(gs.zobristKey), key=lambda entry: -entry[1]):
+            move = ce.Move.fromCode(code, gs.board)
+            print("{}: {}".format(moveNotation(move), weight))
+        book.close()
+
+
+if __name__ == "__main__":
+    main()
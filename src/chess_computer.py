@@ -13,16 +13,111 @@ __version__ = "0.1"
 # %% --------------------------------------------------------------------------
 # Imports
 # -----------------------------------------------------------------------------
+import json
 import random
+import sys
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import Chess.src.chess_engine as ce
 
 # %% --------------------------------------------------------------------------
 # Set piece values
 # -----------------------------------------------------------------------------
 
-pieceScore = {"K":0, "Q":9, "R": 5, "B": 3, "N": 3, "P":1}
+pieceScore = ce.MATERIAL_VALUES  # {"K":0, "Q":9, "R": 5, "B": 3, "N": 3, "P":1}
 CHECKMATE = 1000
 STALEMATE = 0
-DEPTH = 3
+DEPTH = 3  # depth searched when findBestMove isn't given a time or node budget
+MAX_DEPTH = 64  # deepest iteration when searching to a budget
+MAX_PLY = 128  # furthest a line can reach below the root, quiescence included
+MATE_BOUND = CHECKMATE - MAX_PLY  # a mate scores CHECKMATE less the plies from the root to it, so past this is a mate
+TIME_CHECK_NODES = 1024  # nodes between looks at the clock
+QUIESCENCE = True  # play out captures at the end of the search instead of scoring mid exchange
+DELTA_MARGIN = 2  # a capture that can't lift the score to within this of alpha isn't searched
+NULL_WINDOW = 0.0001  # width of the scouting window, only needs to be smaller than any real score gap
+ASPIRATION_WINDOW = 0.5  # first window around the last iteration's score, doubled on each fail
+ASPIRATION_MIN_DEPTH = 3  # shallower iterations are cheap enough to search with the full window
+# selectivity, each can be switched off on its own to compare
+NULL_MOVE_PRUNING = True  # pass the turn, if the opponent still can't get back to beta the node is cut
+NULL_MOVE_REDUCTION = 2  # how much shallower the null move search is
+NULL_MOVE_MIN_DEPTH = 3
+LATE_MOVE_REDUCTIONS = True  # quiet moves late in the ordering are searched a ply shallower first
+LMR_MIN_DEPTH = 3
+LMR_MIN_MOVES = 4  # moves searched at full depth before reducing
+PARALLEL_BACKEND = "bitboard"  # game state the worker processes search with
+TT_SIZE_MB = 16  # memory for the transposition table
+TABLEBASE_WIN = CHECKMATE / 2  # a tablebase win scores this less the plies to mate, below a mate on the board
+# past this a score counts plies from the root (mates and tablebase wins), the table keeps it from the node instead
+DISTANCE_SCORE = TABLEBASE_WIN / 2
+TABLEBASE_MATERIAL = 18  # most material (two queens) the 4 piece tables can have, less than this isn't probed
+
+# what a stored score means, the search failed low (upper bound) or high (lower bound) if not exact
+EXACT, LOWERBOUND, UPPERBOUND = 0, 1, 2
+
+# %% --------------------------------------------------------------------------
+# Transposition table - scores of positions already searched, by zobrist key
+# -----------------------------------------------------------------------------
+
+
+class TranspositionTable:
+    # buckets of two entries: the first keeps the deepest search of the position, the second is
+    # always replaced. Entries are spread over flat arrays so the size in memory is fixed
+    ENTRY_BYTES = 8 + 8 + 4  # key, score, packed depth / flag / move / age
+
+    def __init__(self, sizeMB=TT_SIZE_MB):
+        self.buckets = max(1, sizeMB * 1024 * 1024 // (2 * self.ENTRY_BYTES))
+        self.keys = array("Q", [0]) * (2 * self.buckets)
+        self.scores = array("d", [0.0]) * (2 * self.buckets)
+        # depth (bits 0-7), flag (bits 8-9), best move code (bits 10-25), age (bits 26-31), 0 is empty
+        self.info = array("I", [0]) * (2 * self.buckets)
+        self.age = 1
+        self.probes = 0
+        self.hits = 0
+
+    def clear(self):
+        self.keys = array("Q", [0]) * (2 * self.buckets)
+        self.info = array("I", [0]) * (2 * self.buckets)
+        self.age = 1
+
+    def newSearch(self):
+        # entries from earlier moves are kept but the deep slot can be taken over by the new search
+        self.age = self.age % 63 + 1
+        self.probes = 0
+        self.hits = 0
+
+    def probe(self, key, ply=0):
+        # (depth, flag, score, move code) of the position or None, ply is how far the position is from the root
+        self.probes += 1
+        slot = key % self.buckets * 2
+        for i in (slot, slot + 1):
+            if self.keys[i] == key and self.info[i]:
+                self.hits += 1
+                info = self.info[i]
+                return info & 255, info >> 8 & 3, fromTableScore(self.scores[i], ply), info >> 10 & 0xFFFF
+        return None
+
+    def store(self, key, depth, flag, score, move=0, ply=0):
+        score = toTableScore(score, ply)
+        slot = key % self.buckets * 2
+        deepInfo = self.info[slot]
+        if deepInfo == 0 or self.keys[slot] == key or deepInfo >> 26 != self.age or depth >= deepInfo & 255:
+            i = slot
+        else:
+            i = slot + 1
+        if move == 0 and self.keys[i] == key:
+            move = self.info[i] >> 10 & 0xFFFF  # keep the old best move rather than lose it
+        self.keys[i] = key
+        self.scores[i] = score
+        self.info[i] = depth | flag << 8 | move << 10 | self.age << 26
+
+    def hashfull(self):
+        # permille of a sample of entries used by the current search
+        sample = min(1000, len(self.info))
+        return sum(1 for i in range(sample) if self.info[i] and self.info[i] >> 26 == self.age) * 1000 // sample
+
 
 # %% --------------------------------------------------------------------------
 # Random move computer
@@ -56,7 +151,6 @@ def findBestMoveGreedy(gs, validMoves):
         if score > maxScore :
             maxScore = score
             bestMove = playerMove
-        print(score)
         gs.undoMove()
             
     return bestMove
@@ -96,7 +190,6 @@ def findMoveMinMaxDepthTwo(gs, validMoves):
                 opponentMinMaxScore = opponentMaxScore
                 bestPlayerMove = playerMove
             gs.undoMove()
-    print(opponentMinMaxScore)
     return bestPlayerMove
 
 
@@ -104,16 +197,8 @@ def findMoveMinMaxDepthTwo(gs, validMoves):
 # Recursive method
 # -----------------------------------------------------------------------------
 
-
-def findBestMove(gs, validMoves):
-    global nextMove, counter
-    counter = 0
-    random.shuffle(validMoves)
-    #findMoveMinMax(gs, validMoves, DEPTH, gs.whiteToMove)
-    #findMoveNegaMax(gs, validMoves, DEPTH, 1 if gs.whiteToMove else -1)
-    findMoveNegaMaxAlphaBeta(gs, validMoves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1)
-    print(counter)
-    return nextMove
+nextMove = None  # move picked by findMoveMinMax and findMoveNegaMax
+counter = 0  # nodes they searched
 
 
 def findMoveMinMax(gs, validMoves, depth, whiteToMove):
@@ -152,7 +237,9 @@ def findMoveNegaMax(gs, validMoves, depth, turnMultiplier):
     global nextMove, counter
     counter += 1
     if depth == 0:
-        return turnMultiplier * scoreMaterial(gs.board)
+        return turnMultiplier * scorePosition(gs) # same leaf score as the alpha-beta search so it can check it
+    if not validMoves:
+        return STALEMATE if gs.stalemate else -(CHECKMATE - (DEPTH - depth))
     
     maxScore = -CHECKMATE
     for move in validMoves:
@@ -166,32 +253,717 @@ def findMoveNegaMax(gs, validMoves, depth, turnMultiplier):
         gs.undoMove()
     return maxScore  
 
-# negamax but not searching unnecessary moves
+# %% --------------------------------------------------------------------------
+# Searcher - alpha-beta search with its own tables, settings and counters so several
+# games can be searched at once without sharing anything
+# -----------------------------------------------------------------------------
 
-def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier):
-    global nextMove, counter
-    counter += 1
-    if depth == 0:
-        return turnMultiplier * scoreMaterial(gs.board)
 
-    ## TODO move ordering - look at captures/ checks
+class SearchTimeout(Exception):
+    # raised inside the search when the budget runs out, searchPosition catches it and unwinds the board
+    pass
 
-    maxScore = -CHECKMATE
-    for move in validMoves:
-        gs.makeMove(move)
-        nextMoves = gs.getValidMoves()
-        score = -findMoveNegaMaxAlphaBeta(gs, nextMoves, depth -1, -alpha, -beta,-turnMultiplier)
-        if score > maxScore:
-            maxScore = score
-            if depth == DEPTH:
-                nextMove = move
-        gs.undoMove()
-        if maxScore > alpha:
-            alpha = maxScore
-        # worse than other branches so prune    
-        if alpha >= beta:
-            break
-    return maxScore  
+
+class Searcher:
+    def __init__(self, ttSizeMB=TT_SIZE_MB, depth=DEPTH, quiescence=QUIESCENCE, nullMovePruning=NULL_MOVE_PRUNING,
+                 lateMoveReductions=LATE_MOVE_REDUCTIONS, book=None, tablebases=None, evaluator=None):
+        # settings
+        self.book = book  # chess_book.OpeningBook asked before searching, None to always search
+        self.tablebases = tablebases  # chess_tablebase.Tablebases probed in endings, None to search them
+        self.evaluator = evaluator  # chess_nnue.Network to score positions with, None for scorePosition
+        self.ttSizeMB = ttSizeMB
+        self.depth = depth  # depth searched when there is no time or node budget
+        self.quiescenceSearch = quiescence
+        self.nullMovePruning = nullMovePruning
+        self.lateMoveReductions = lateMoveReductions
+
+        self.transpositionTable = TranspositionTable(ttSizeMB)  # kept between moves so the next search starts warm
+        # two quiet moves per ply that caused a cutoff, tried early in sibling positions
+        self.killerMoves = [[0, 0] for ply in range(MAX_DEPTH + 1)]
+        # how much each quiet move (by the low 12 bits of its code, start and end square) has caused cutoffs
+        self.historyTable = {"w": [0] * 4096, "b": [0] * 4096}
+        # how well the ordering works, a cutoff on the first move searched is the ideal
+        self.stats = {"qnodes": 0, "cutoffs": 0, "firstMoveCutoffs": 0, "killerCutoffs": 0,
+                      "nullMoveCutoffs": 0, "reductions": 0, "reductionResearches": 0, "tablebaseHits": 0}
+
+        # state of the running search
+        self.nodes = 0
+        self.rootPly = 0  # length of the move log at the root, to work out the ply of a node
+        self.rootDepth = 0
+        self.deadline = None  # time.perf_counter() value to stop at
+        self.nodeLimit = None
+        self.stopRequested = False
+
+        # result of the last search
+        self.bestMove = None
+        self.score = 0
+        self.principalVariation = []
+        self.iterations = []  # stats of each depth finished, see recordIteration
+        self.searchTime = 0
+        # called with a dict after each depth and at the end of each search, jsonLinesWriter() logs them
+        self.statsCallback = None
+
+    def getSettings(self):
+        # what a worker process needs to build the same Searcher, the tablebases and network go as their files
+        if self.evaluator is not None and self.evaluator.path is None:
+            raise ValueError("a parallel search needs the evaluator loaded from a file with Network.load")
+        return {"ttSizeMB": self.ttSizeMB, "depth": self.depth, "quiescence": self.quiescenceSearch,
+                "nullMovePruning": self.nullMovePruning, "lateMoveReductions": self.lateMoveReductions,
+                "tablebaseDir": self.tablebases.directory if self.tablebases is not None else None,
+                "nnuePath": self.evaluator.path if self.evaluator is not None else None}
+
+    def newGame(self):
+        self.transpositionTable.clear()
+        for table in self.historyTable.values():
+            for i in range(len(table)):
+                table[i] = 0
+
+    def stop(self):
+        # ask a running search to stop at its next clock check, safe to call from another thread
+        self.stopRequested = True
+
+    def checkBudget(self):
+        if self.stopRequested or (self.nodeLimit is not None and self.nodes >= self.nodeLimit) or \
+                (self.deadline is not None and time.perf_counter() >= self.deadline):
+            raise SearchTimeout()
+
+    def resetOrdering(self):
+        # killers only make sense near the position they came from, history is halved so it favours recent searches
+        for killers in self.killerMoves:
+            killers[0] = killers[1] = 0
+        for table in self.historyTable.values():
+            for i in range(len(table)):
+                table[i] >>= 1
+        for stat in self.stats:
+            self.stats[stat] = 0
+
+    def getStats(self):
+        # totals for the last search, nodes include the quiescence nodes
+        stats = dict(self.stats)
+        stats["nodes"] = self.nodes
+        stats["depth"] = self.iterations[-1]["depth"] if self.iterations else self.rootDepth  # last one finished
+        stats["timeMs"] = round(self.searchTime * 1000, 1)
+        stats["nps"] = round(self.nodes / self.searchTime) if self.searchTime else 0
+        stats["firstMoveCutoffRate"] = stats["firstMoveCutoffs"] / stats["cutoffs"] if stats["cutoffs"] else 0
+        stats["ttProbes"] = self.transpositionTable.probes
+        stats["ttHits"] = self.transpositionTable.hits
+        stats["ttHitRate"] = stats["ttHits"] / stats["ttProbes"] if stats["ttProbes"] else 0
+        # effective branching factor, how many times more nodes each depth took than the one before
+        # (geometric mean over the iterations)
+        if len(self.iterations) >= 2 and self.iterations[0]["nodes"]:
+            stats["ebf"] = (self.iterations[-1]["nodes"] / self.iterations[0]["nodes"]) ** (1 / (len(self.iterations) - 1))
+        else:
+            stats["ebf"] = None
+        stats["bestMove"] = self.bestMove.getChessNotation() if self.bestMove is not None else None
+        stats["score"] = self.score
+        stats["pv"] = [move.getChessNotation() for move in self.principalVariation]
+        stats["iterations"] = list(self.iterations)
+        return stats
+
+    def counters(self):
+        # running totals an iteration's share is worked out from
+        return (time.perf_counter(), self.nodes, self.stats["qnodes"], self.stats["cutoffs"],
+                self.stats["firstMoveCutoffs"], self.transpositionTable.probes, self.transpositionTable.hits)
+
+    def recordIteration(self, depth, score, pv, start):
+        # stats of one finished depth, start is counters() from before it, sent to statsCallback
+        end = self.counters()
+        seconds, nodes, qnodes, cutoffs, firstMoveCutoffs, probes, hits = (b - a for a, b in zip(start, end))
+        previous = self.iterations[-1]["nodes"] if self.iterations else 0
+        record = {"event": "iteration", "depth": depth, "score": score,
+                  "pv": [move.getChessNotation() for move in pv], "nodes": nodes, "qnodes": qnodes,
+                  "totalNodes": self.nodes, "timeMs": round(seconds * 1000, 1),
+                  "nps": round(nodes / seconds) if seconds else 0,
+                  "ebf": nodes / previous if previous else None,
+                  "firstMoveCutoffRate": firstMoveCutoffs / cutoffs if cutoffs else 0,
+                  "ttHitRate": hits / probes if probes else 0}
+        self.iterations.append(record)
+        if self.statsCallback is not None:
+            self.statsCallback(record)
+
+    def finishSearch(self, startTime):
+        self.searchTime = time.perf_counter() - startTime
+        if self.statsCallback is not None:
+            record = self.getStats()
+            del record["iterations"]  # already sent one at a time
+            record["event"] = "search"
+            self.statsCallback(record)
+
+    def recordParallelIteration(self, records, score, pv):
+        # one depth of a parallel search from each worker's record of it, the counts are added up and
+        # the rates weighted by each worker's nodes
+        nodes = sum(record["nodes"] for record in records)
+        seconds = max(record["timeMs"] for record in records) / 1000  # the workers search at the same time
+        previous = self.iterations[-1]["nodes"] if self.iterations else 0
+        record = {"event": "iteration", "depth": records[0]["depth"], "score": score,
+                  "pv": [move.getChessNotation() for move in pv], "nodes": nodes,
+                  "qnodes": sum(record["qnodes"] for record in records),
+                  "totalNodes": sum(record["totalNodes"] for record in records), "timeMs": round(seconds * 1000, 1),
+                  "nps": round(nodes / seconds) if seconds else 0,
+                  "ebf": nodes / previous if previous else None}
+        for rate in ("firstMoveCutoffRate", "ttHitRate"):
+            record[rate] = sum(worker[rate] * worker["nodes"] for worker in records) / nodes if nodes else 0
+        self.iterations.append(record)
+        if self.statsCallback is not None:
+            self.statsCallback(record)
+
+    def evaluate(self, gs, turnMultiplier):
+        # leaf score for the side to move
+        if self.evaluator is None:
+            return turnMultiplier * scorePosition(gs)
+        return self.evaluator.evaluate(gs)
+
+    def findBestMove(self, gs, validMoves, timeLimit=None, maxNodes=None, maxDepth=None, workers=1):
+        # a book move if there is one, otherwise iterative deepening to a time, node or depth budget,
+        # see searchPosition and searchParallel
+        if self.book is not None:
+            move = self.book.pickMove(gs, validMoves)
+            if move is not None:
+                self.nodes, self.rootDepth, self.iterations, self.searchTime = 0, 0, [], 0
+                self.bestMove, self.score, self.principalVariation = move, 0, [move]
+                return move
+        if self.tablebases is not None:
+            move = self.tablebases.pickMove(gs, validMoves)
+            if move is not None:
+                self.nodes, self.rootDepth, self.iterations, self.searchTime = 0, 0, [], 0
+                self.bestMove, self.score, self.principalVariation = move, tablebaseScore(self.tablebases.probe(gs)), [move]
+                return move
+        if workers > 1 and len(validMoves) > 1:
+            return self.searchParallel(gs, validMoves, workers, timeLimit, maxNodes, maxDepth)[0]
+        return self.searchPosition(gs, validMoves, timeLimit, maxNodes, maxDepth)[0]
+
+    def searchPosition(self, gs, validMoves, timeLimit=None, maxNodes=None, maxDepth=None, onIteration=None):
+        # searches depth 1, 2, 3... and returns (best move, score, principal variation) of the last depth
+        # that finished. With no time or node budget it stops at self.depth. onIteration(depth, score, pv)
+        # is called after each depth, statsCallback gets the stats of each depth
+        startTime = time.perf_counter()
+        self.nodes = 0
+        self.iterations = []
+        self.rootPly = len(gs.moveLog)
+        self.resetOrdering()
+        self.stopRequested = False
+        self.deadline = None if timeLimit is None else time.perf_counter() + timeLimit
+        self.nodeLimit = maxNodes
+        if maxDepth is None:
+            maxDepth = self.depth if timeLimit is None and maxNodes is None else MAX_DEPTH
+        self.transpositionTable.newSearch()
+        # the network's accumulator follows the moves of the search, it is taken off again at the end
+        attached = self.evaluator is not None and \
+            (gs.accumulator is None or gs.accumulator.network is not self.evaluator)
+        if attached:
+            gs.accumulator = self.evaluator.newAccumulator(gs.board)
+        random.shuffle(validMoves)  # so equal moves aren't always played the same way
+        turnMultiplier = 1 if gs.whiteToMove else -1
+        history = self.historyTable["w" if gs.whiteToMove else "b"]
+
+        bestMove, bestScore, principalVariation = None, 0, []
+        for depth in range(1, maxDepth + 1):
+            entry = self.transpositionTable.probe(gs.zobristKey)
+            hashMove = entry[3] if entry is not None and entry[3] else None
+            # best move so far first, then captures by most valuable victim / least valuable attacker
+            validMoves.sort(key=lambda move: gs.moveOrderKey(move.code, hashMove, self.killerMoves[0], history),
+                            reverse=True)
+            self.rootDepth = depth
+            start = self.counters()
+            try:
+                # aspiration window, a narrow window around the last score prunes more. If the score
+                # falls outside it the window is widened and the depth searched again
+                window = ASPIRATION_WINDOW
+                if depth >= ASPIRATION_MIN_DEPTH and abs(bestScore) < MATE_BOUND:
+                    alpha, beta = bestScore - window, bestScore + window
+                else:
+                    alpha, beta = -CHECKMATE, CHECKMATE
+                while True:
+                    score, pv = self.searchRoot(gs, validMoves, depth, alpha, beta, turnMultiplier)
+                    if score <= alpha and alpha > -CHECKMATE:
+                        window *= 2
+                        alpha = max(score - window, -CHECKMATE)
+                    elif score >= beta and beta < CHECKMATE:
+                        window *= 2
+                        beta = min(score + window, CHECKMATE)
+                    else:
+                        break
+            except SearchTimeout:
+                while len(gs.moveLog) > self.rootPly:  # the search was stopped part way down a line
+                    gs.undoMove()
+                if bestMove is None and validMoves:
+                    bestMove = validMoves[0]  # depth 1 didn't finish, the first in the ordering is the best guess
+                break
+            if not pv:
+                break  # no legal moves
+            bestMove, bestScore, principalVariation = pv[0], score, self.extendPrincipalVariation(gs, pv, depth)
+            self.recordIteration(depth, bestScore, principalVariation, start)
+            if onIteration is not None:
+                onIteration(depth, bestScore, principalVariation)
+            if abs(bestScore) >= MATE_BOUND and CHECKMATE - abs(bestScore) <= depth:
+                break  # every line to the mate was searched in full, looking deeper won't find a shorter one
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                break
+        if attached:
+            gs.accumulator = None
+        self.bestMove, self.score, self.principalVariation = bestMove, bestScore, principalVariation
+        self.finishSearch(startTime)
+        return bestMove, bestScore, principalVariation
+
+    def extendPrincipalVariation(self, gs, pv, depth):
+        # pv is the root Move then the codes the search found. A line ends early where the search used a
+        # stored score, carry it on with the stored best moves. Played out so the move log gives the Moves
+        gs.makeMove(pv[0])
+        for code in pv[1:]:
+            gs.makeMoveCode(code)
+        while len(gs.moveLog) - self.rootPly < depth:
+            entry = self.transpositionTable.probe(gs.zobristKey)
+            if entry is None or not entry[3] or entry[3] not in gs.getValidMoveCodes():
+                break
+            gs.makeMoveCode(entry[3])
+        pv = gs.moveLog[self.rootPly:]
+        for _ in pv:
+            gs.undoMove()
+        return pv
+
+    def searchRoot(self, gs, validMoves, depth, alpha, beta, turnMultiplier):
+        # like findMoveNegaMaxAlphaBeta but always searches (no table cutoff) and returns the score with
+        # the principal variation, the first move of which is the move to play
+        self.nodes += 1
+        alphaOriginal = alpha
+        maxScore = -CHECKMATE
+        principalVariation = []
+        for i, move in enumerate(validMoves):
+            childPV = []
+            gs.makeMove(move)
+            if i == 0:
+                score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth - 1, -beta, -alpha, -turnMultiplier, childPV)
+            else:
+                score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth - 1, -alpha - NULL_WINDOW, -alpha,
+                                                       -turnMultiplier, childPV)
+                if alpha < score < beta:
+                    childPV = []
+                    score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth - 1, -beta, -alpha, -turnMultiplier, childPV)
+            gs.undoMove()
+            if score > maxScore:
+                maxScore = score
+                principalVariation = [move] + childPV
+            if maxScore > alpha:
+                alpha = maxScore
+            if alpha >= beta:
+                break
+
+        if principalVariation:
+            flag = UPPERBOUND if maxScore <= alphaOriginal else LOWERBOUND if maxScore >= beta else EXACT
+            self.transpositionTable.store(gs.zobristKey, depth, flag, maxScore, principalVariation[0].code)
+        return maxScore, principalVariation
+
+    def findMoveNegaMaxAlphaBeta(self, gs, validMoves, depth, alpha, beta, turnMultiplier, pv=None, allowNullMove=True):
+        # principal variation search, the first move gets the full window and the rest are scouted with a
+        # null window and only searched again if they beat alpha. validMoves is None below the root so the
+        # moves are generated with the stored best move first. Below the root moves are 16 bit codes, pv is
+        # filled with the codes of the best line found
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_NODES == 0 or self.nodes == self.nodeLimit:
+            self.checkBudget()
+        ply = len(gs.moveLog) + len(gs.nullMoveStack) - self.rootPly  # a null move is a ply too
+        if self.tablebases is not None and gs.material["w"] + gs.material["b"] <= TABLEBASE_MATERIAL:
+            value = self.tablebases.probe(gs)
+            if value is not None:
+                self.stats["tablebaseHits"] += 1
+                return tablebaseScore(value, ply)
+        if depth == 0:
+            if self.quiescenceSearch:
+                return self.quiescence(gs, alpha, beta, turnMultiplier)
+            return self.evaluate(gs, turnMultiplier)
+
+        stats = self.stats
+        transpositionTable = self.transpositionTable
+        alphaOriginal = alpha
+        # from the window passed in, before the table narrows it. A null window is NULL_WINDOW wide give or
+        # take the float rounding of -alpha - NULL_WINDOW, so anything over twice that is a full window
+        isPVNode = beta - alpha > 2 * NULL_WINDOW
+        hashMove = None
+        entry = transpositionTable.probe(gs.zobristKey, ply)
+        if entry is not None:
+            entryDepth, flag, score, hashMove = entry
+            if entryDepth >= depth:
+                if flag == EXACT:
+                    return score
+                elif flag == LOWERBOUND:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    return score
+        killers = self.killerMoves[ply]
+        ally = "w" if gs.whiteToMove else "b"
+        history = self.historyTable[ally]
+        inCheck = (self.nullMovePruning or self.lateMoveReductions) and depth >= 2 and gs.incheck()
+
+        # null move pruning, not in check, after another null move or with only pawns (zugzwang is likely)
+        if self.nullMovePruning and allowNullMove and not isPVNode and not inCheck and depth >= NULL_MOVE_MIN_DEPTH \
+                and gs.nonPawnMaterial[ally] > 0 and self.evaluate(gs, turnMultiplier) >= beta:
+            nullPly = len(gs.moveLog)
+            gs.makeNullMove()
+            try:
+                score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth - 1 - NULL_MOVE_REDUCTION, -beta,
+                                                       -beta + NULL_WINDOW, -turnMultiplier, None, False)
+            finally:
+                # on a timeout the moves after the null move are still made, they have to go first
+                while len(gs.moveLog) > nullPly:
+                    gs.undoMove()
+                gs.undoNullMove()
+            if score >= beta:
+                stats["nullMoveCutoffs"] += 1
+                return beta if score >= MATE_BOUND else score  # a mate found after passing isn't real
+
+        if validMoves is None:
+            # lazy, captures first and the rest only built if there is no cutoff
+            validMoves = gs.generateMoveCodesStaged(hashMove or None, killers, history)
+
+        maxScore = -(CHECKMATE - ply)  # what is left if there are no moves and it's checkmate
+        bestMove = None
+        searched = 0
+        for code in validMoves:
+            searched += 1
+            childPV = [] if pv is not None else None
+            isQuiet = code & 0x3000 != ce.MOVE_PROMOTION and gs.movePieces(code)[1] == "--"
+            gs.makeMoveCode(code)
+            if searched == 1:
+                score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth -1, -beta, -alpha, -turnMultiplier, childPV)
+            else:
+                reduction = 0
+                if self.lateMoveReductions and searched > LMR_MIN_MOVES and depth >= LMR_MIN_DEPTH and not inCheck and \
+                        isQuiet and code not in killers and not gs.incheck():  # quiet, late and doesn't give check
+                    reduction = 1 if searched <= 2 * LMR_MIN_MOVES else 2
+                    reduction = min(reduction, depth - 2)
+                score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth -1 - reduction, -alpha - NULL_WINDOW, -alpha,
+                                                       -turnMultiplier, childPV)
+                if reduction:
+                    stats["reductions"] += 1
+                    if score > alpha:  # the reduced search says it might be good, so look properly
+                        stats["reductionResearches"] += 1
+                        score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth -1, -alpha - NULL_WINDOW, -alpha,
+                                                               -turnMultiplier, childPV)
+                if alpha < score < beta:  # better than the first move so find its real score
+                    childPV = [] if pv is not None else None
+                    score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth -1, -beta, -alpha, -turnMultiplier, childPV)
+            if score > maxScore:
+                maxScore = score
+                bestMove = code
+                if pv is not None and score > alpha:
+                    pv[:] = [code] + childPV
+            gs.undoMove()
+            if maxScore > alpha:
+                alpha = maxScore
+            # worse than other branches so prune
+            if alpha >= beta:
+                stats["cutoffs"] += 1
+                if searched == 1:
+                    stats["firstMoveCutoffs"] += 1
+                if isQuiet:
+                    if code in killers:
+                        stats["killerCutoffs"] += 1
+                    elif code != killers[0]:
+                        killers[1] = killers[0]
+                        killers[0] = code
+                    history[code & 0xFFF] += depth * depth
+                break
+        if not searched and gs.stalemate: # generator sets checkmate or stalemate once it runs out
+            maxScore = STALEMATE
+
+        if maxScore <= alphaOriginal:
+            flag = UPPERBOUND
+        elif maxScore >= beta:
+            flag = LOWERBOUND
+        else:
+            flag = EXACT
+        transpositionTable.store(gs.zobristKey, depth, flag, maxScore, bestMove if bestMove is not None else 0, ply)
+        return maxScore
+
+    def quiescence(self, gs, alpha, beta, turnMultiplier):
+        # only captures and promotions until the position is quiet, so a leaf isn't scored half way
+        # through an exchange. In check every evasion is searched as standing pat isn't an option
+        self.nodes += 1
+        self.stats["qnodes"] += 1
+        if self.nodes % TIME_CHECK_NODES == 0 or self.nodes == self.nodeLimit:
+            self.checkBudget()
+
+        inCheck = gs.incheck()
+        if inCheck:
+            moves = gs.getValidMoveCodes()
+            ply = len(gs.moveLog) + len(gs.nullMoveStack) - self.rootPly
+            if not moves:
+                return -(CHECKMATE - ply) if gs.checkmate else STALEMATE
+            moves = sorted(moves, key=gs.captureOrderKey, reverse=True)
+            maxScore = -(CHECKMATE - ply)
+        else:
+            standPat = self.evaluate(gs, turnMultiplier)  # the side to move can usually do at least this well
+            if standPat >= beta:
+                return standPat
+            if standPat > alpha:
+                alpha = standPat
+            moves = sorted(gs.getCaptureCodes(includePromotions=True), key=gs.captureOrderKey, reverse=True)
+            maxScore = standPat
+
+        for code in moves:
+            if not inCheck:
+                if code & 0x3000 == ce.MOVE_PROMOTION:
+                    if code >> 14:
+                        continue  # underpromotions are left to the main search
+                elif standPat + pieceScore[gs.movePieces(code)[1][1]] + DELTA_MARGIN <= alpha:
+                    continue  # delta pruning, even winning the piece for free won't raise alpha
+            gs.makeMoveCode(code)
+            score = -self.quiescence(gs, -beta, -alpha, -turnMultiplier)
+            gs.undoMove()
+            if score > maxScore:
+                maxScore = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return maxScore
+
+    def searchParallel(self, gs, validMoves, workers, timeLimit=None, maxNodes=None, maxDepth=None):
+        # root moves are dealt out in their ordering so each worker gets a share of the likely best moves,
+        # the workers search their moves independently and the best score at the deepest depth all the
+        # workers finished wins. Returns (best move, score, principal variation) like searchPosition
+        startTime = time.perf_counter()
+        self.iterations = []
+        history = self.historyTable["w" if gs.whiteToMove else "b"]
+        entry = self.transpositionTable.probe(gs.zobristKey)
+        hashMove = entry[3] if entry is not None and entry[3] else None
+        ordered = sorted(validMoves, key=lambda move: gs.moveOrderKey(move.code, hashMove, (), history), reverse=True)
+        workers = min(workers, len(ordered))
+        fen = gs.getFEN()
+        settings = self.getSettings()
+        tasks = [(settings, fen, {move.code for move in ordered[i::workers]}, timeLimit,
+                  None if maxNodes is None else maxNodes // workers, maxDepth) for i in range(workers)]
+        results = list(getProcessPool(workers).map(searchRootMoves, tasks))
+
+        # the workers' counters are added up, their table probes stay in the workers
+        self.nodes = sum(nodes for _, nodes, _, _ in results)
+        for stat in self.stats:
+            self.stats[stat] = sum(stats[stat] for _, _, stats, _ in results)
+        self.transpositionTable.probes = self.transpositionTable.hits = 0
+        finished = [iterations for iterations, _, _, _ in results if iterations]
+        if len(finished) < len(results):
+            # a worker didn't finish depth 1, best guess from the ordering
+            self.bestMove, self.score, self.principalVariation = ordered[0], 0, [ordered[0]]
+            self.finishSearch(startTime)
+            return ordered[0], 0, [ordered[0]]
+        depth = min(iterations[-1][0] for iterations in finished)
+        for iterationDepth in range(1, depth + 1):
+            # the best root move over the workers at each depth, sent to statsCallback like searchPosition does
+            best = max((result for iterations in finished for result in iterations if result[0] == iterationDepth),
+                       key=lambda result: result[2])
+            bestMove = next(move for move in validMoves if move.code == best[1])
+            board = [row[:] for row in gs.board]  # pv codes are turned back into moves on a copy of the position
+            pv = []
+            for code in best[3]:
+                move = ce.Move.fromCode(code, board) if pv else bestMove
+                pv.append(move)
+                applyToBoard(board, move)
+            self.recordParallelIteration([next(record for record in records if record["depth"] == iterationDepth)
+                                          for _, _, _, records in results], best[2], pv)
+        self.transpositionTable.store(gs.zobristKey, depth, EXACT, best[2], best[1])
+        self.rootDepth = depth
+        self.bestMove, self.score, self.principalVariation = bestMove, best[2], pv
+        self.finishSearch(startTime)
+        return bestMove, best[2], pv
+
+# %% --------------------------------------------------------------------------
+# Module level search with one shared Searcher, what chess_main uses
+# -----------------------------------------------------------------------------
+
+defaultSearcher = Searcher()
+
+
+def findBestMove(gs, validMoves, timeLimit=None, maxNodes=None, maxDepth=None, workers=1):
+    return defaultSearcher.findBestMove(gs, validMoves, timeLimit, maxNodes, maxDepth, workers)
+
+
+def searchPosition(gs, validMoves, timeLimit=None, maxNodes=None, maxDepth=None, onIteration=None):
+    return defaultSearcher.searchPosition(gs, validMoves, timeLimit, maxNodes, maxDepth, onIteration)
+
+
+def stopSearch():
+    defaultSearcher.stop()
+
+
+def getSearchStats():
+    return defaultSearcher.getStats()
+
+
+def jsonLinesWriter(file=None):
+    # a Searcher.statsCallback that writes each record as one line of JSON, to stdout by default
+    def write(record):
+        out = sys.stdout if file is None else file
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+    return write
+
+# %% --------------------------------------------------------------------------
+# Pondering - searching on the opponent's time
+# -----------------------------------------------------------------------------
+
+
+class Ponderer:
+    # after the computer moves, the reply it expects (second move of its principal variation) is played on a
+    # copy of the game and searched on a background thread until the opponent moves. If they play it the
+    # search carries on for what is left of the move's time, otherwise it is stopped and the tables it
+    # filled are still there for the real search. The searcher mustn't be used by anything else meanwhile
+    def __init__(self, searcher):
+        self.searcher = searcher
+        self.thread = None
+        self.key = None  # zobrist key of the position being pondered
+        self.startTime = 0
+        self.result = None
+        self.hits = 0
+        self.misses = 0
+
+    def start(self, gs):
+        # ponder the position after the expected reply, nothing happens if there isn't one
+        self.stop()
+        pv = self.searcher.principalVariation
+        if len(pv) < 2 or not gs.moveLog or pv[0].code != gs.moveLog[-1].code:
+            return False
+        ponderGs = type(gs)()  # same backend, its own board so the game can still be drawn
+        ponderGs.loadFEN(gs.getFEN())
+        reply = next((move for move in ponderGs.getValidMoves() if move.code == pv[1].code), None)
+        if reply is None:
+            return False
+        ponderGs.makeMove(reply)
+        validMoves = ponderGs.getValidMoves()
+        if not validMoves:
+            return False
+        for source in (self.searcher.book, self.searcher.tablebases):
+            if source is not None and source.pickMove(ponderGs, validMoves) is not None:
+                return False  # the move will be looked up, not searched
+        self.key = ponderGs.zobristKey
+        self.result = None
+        self.startTime = time.perf_counter()
+        self.thread = threading.Thread(target=self.run, args=(ponderGs, validMoves), daemon=True)
+        self.thread.start()
+        return True
+
+    def run(self, gs, validMoves):
+        # no budget, searches until stop or a deadline is set on a ponder hit
+        self.result = self.searcher.searchPosition(gs, validMoves, maxDepth=MAX_DEPTH)
+
+    def stop(self):
+        if self.thread is not None:
+            while self.thread.is_alive():  # asked again in case the search hadn't started when first asked
+                self.searcher.stop()
+                self.thread.join(0.01)
+            self.thread = None
+
+    def finish(self, gs, validMoves, timeLimit):
+        # call when it's the computer's turn. The pondered move if the opponent played the expected
+        # reply, it is given timeLimit from when pondering started. None if there is nothing to use
+        if self.thread is None:
+            return None
+        if gs.zobristKey != self.key:
+            self.misses += 1
+            self.stop()
+            return None
+        self.hits += 1
+        deadline = self.startTime + timeLimit
+        if time.perf_counter() >= deadline:
+            self.stop()  # it has already thought for longer than it would have
+        else:
+            while self.thread.is_alive():  # set again in case the search hadn't started and cleared it
+                self.searcher.deadline = deadline
+                self.thread.join(0.01)
+            self.thread = None
+        if self.result is None or self.result[0] is None:
+            return None
+        return next((move for move in validMoves if move.code == self.result[0].code), None)
+
+# %% --------------------------------------------------------------------------
+# Root parallel search - the root moves are split over worker processes
+# -----------------------------------------------------------------------------
+
+processPool = None  # kept between moves, starting processes costs more than a shallow search
+processPoolWorkers = 0
+workerSearchers = {}  # in a worker process, one Searcher per group of settings so its tables stay warm
+
+
+def getProcessPool(workers):
+    global processPool, processPoolWorkers
+    if processPool is None or processPoolWorkers != workers:
+        shutdownProcessPool()
+        processPool = ProcessPoolExecutor(max_workers=workers)
+        processPoolWorkers = workers
+    return processPool
+
+
+def shutdownProcessPool():
+    global processPool
+    if processPool is not None:
+        processPool.shutdown()
+        processPool = None
+
+
+def searchRootMoves(args):
+    # runs in a worker process, searches only some of the root moves. Returns
+    # [(depth, move code, score, pv codes)] for each depth finished, the node count, the search stats
+    # and the stats of each depth (Searcher.iterations)
+    settings, fen, codes, timeLimit, maxNodes, maxDepth = args
+    key = tuple(sorted(settings.items()))
+    if key not in workerSearchers:
+        workerSearchers[key] = makeWorkerSearcher(settings)
+    searcher = workerSearchers[key]
+    gs = ce.createGameState(PARALLEL_BACKEND)
+    gs.loadFEN(fen)
+    moves = [move for move in gs.getValidMoves() if move.code in codes]
+    iterations = []
+    searcher.searchPosition(gs, moves, timeLimit, maxNodes, maxDepth,
+                            lambda depth, score, pv: iterations.append((depth, pv[0].code, score,
+                                                                        [move.code for move in pv])))
+    return iterations, searcher.nodes, searcher.stats, searcher.iterations
+
+
+def makeWorkerSearcher(settings):
+    # the Searcher of Searcher.getSettings, its tablebases and network loaded from their files
+    settings = dict(settings)
+    tablebaseDir = settings.pop("tablebaseDir")
+    nnuePath = settings.pop("nnuePath")
+    searcher = Searcher(**settings)
+    if tablebaseDir is not None:
+        from Chess.src.chess_tablebase import Tablebases
+        searcher.tablebases = Tablebases(tablebaseDir)
+    if nnuePath is not None:
+        from Chess.src.chess_nnue import Network
+        searcher.evaluator = Network.load(nnuePath)
+    return searcher
+
+
+def applyToBoard(board, move):
+    # just enough of makeMove to decode the next move of a principal variation
+    board[move.endRow][move.endCol] = move.pieceMoved[0] + move.promotionPiece if move.isPawnPromotion else move.pieceMoved
+    board[move.startRow][move.startCol] = "--"
+    if move.isEnpassantMove:
+        board[move.startRow][move.endCol] = "--"
+    elif move.isCastleMove:
+        rookFrom, rookTo = (7, 5) if move.endCol == 6 else (0, 3)
+        board[move.endRow][rookTo] = board[move.endRow][rookFrom]
+        board[move.endRow][rookFrom] = "--"
+
+
+def benchmarkParallel(fens, maxDepth=4, workerCounts=(1, 2, 4, 8, 16)):
+    # time a fixed depth search of each position with each number of workers, returns
+    # [(workers, seconds, nodes, speed up over one worker)]
+    results = []
+    for workers in workerCounts:
+        nodes = 0
+        start = time.perf_counter()
+        for fen in fens:
+            gs = ce.createGameState(PARALLEL_BACKEND)
+            gs.loadFEN(fen)
+            searcher = Searcher()
+            searcher.findBestMove(gs, gs.getValidMoves(), maxDepth=maxDepth, workers=workers)
+            nodes += searcher.nodes
+        elapsed = time.perf_counter() - start
+        results.append((workers, elapsed, nodes, results[0][1] / elapsed if results else 1.0))
+    shutdownProcessPool()
+    return results
 
 # %% --------------------------------------------------------------------------
 #  Score the value of piece
@@ -212,6 +984,43 @@ def scoreMaterial(board):
                 
     return score
 
+def tablebaseScore(value, ply=0):
+    # search score for the side to move of a stored chess_tablebase value (win in n plies is n,
+    # loss in n is -(n + 1)) ply plies below the root, quicker wins and slower losses score higher
+    if value > 0:
+        return TABLEBASE_WIN - value - ply
+    if value < 0:
+        return -(TABLEBASE_WIN + value + 1 - ply)
+    return STALEMATE
+
+
+def toTableScore(score, ply):
+    # mates and tablebase wins count plies from the root, stored they count from the position itself
+    # so the score is right wherever the position turns up again
+    if score >= DISTANCE_SCORE:
+        return score + ply
+    if score <= -DISTANCE_SCORE:
+        return score - ply
+    return score
+
+
+def fromTableScore(score, ply):
+    if score >= DISTANCE_SCORE:
+        return score - ply
+    if score <= -DISTANCE_SCORE:
+        return score + ply
+    return score
+
+
+def scorePosition(gs):
+    # positive is good for white, reads the totals makeMove and undoMove keep so it doesn't scan the board
+    # piece square bonuses blend from the midgame to the endgame table as pieces come off
+    phase = min(gs.gamePhase, ce.MAX_PHASE)
+    midgame = gs.pstMidgame["w"] - gs.pstMidgame["b"]
+    endgame = gs.pstEndgame["w"] - gs.pstEndgame["b"]
+    positional = (midgame * phase + endgame * (ce.MAX_PHASE - phase)) / ce.MAX_PHASE
+    return gs.material["w"] - gs.material["b"] + positional / 100
+
 def scoreBoard(gs):
     # positive score is good for white
     if gs.checkmate:
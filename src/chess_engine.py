@@ -15,6 +15,146 @@ __version__ = "0.1"
 ## TODO reinforcement learning bot
 ## TODO add to website
 
+# %% --------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import random
+from array import array
+from collections import OrderedDict
+
+# %% --------------------------------------------------------------------------
+# Zobrist keys - a random 64 bit number for each feature of a position
+# -----------------------------------------------------------------------------
+
+zobristRandom = random.Random(20221228)  # fixed seed so keys are the same every run
+ZOBRIST_PIECES = {colour + piece: [[zobristRandom.getrandbits(64) for c in range(8)] for r in range(8)]
+                  for colour in "wb" for piece in "PNBRQK"}
+ZOBRIST_BLACK_TO_MOVE = zobristRandom.getrandbits(64)
+ZOBRIST_CASTLE = [zobristRandom.getrandbits(64) for mask in range(16)]  # indexed by CastleRights.toMask()
+ZOBRIST_ENPASSANT = [zobristRandom.getrandbits(64) for col in range(8)]  # indexed by the enpassant file
+
+# %% --------------------------------------------------------------------------
+# Castle rights as a 4 bit mask and the undo stack
+# -----------------------------------------------------------------------------
+
+WKS, BKS, WQS, BQS = 1, 2, 4, 8  # same bits as CastleRights.toMask()
+# rights kept when a piece moves from or to each square, moving the king or a rook or
+# capturing a rook on its starting square loses the matching rights
+CASTLE_RIGHTS_KEPT = [15] * 64
+CASTLE_RIGHTS_KEPT[0] = 15 & ~BQS  # a8
+CASTLE_RIGHTS_KEPT[4] = 15 & ~(BKS | BQS)  # e8
+CASTLE_RIGHTS_KEPT[7] = 15 & ~BKS  # h8
+CASTLE_RIGHTS_KEPT[56] = 15 & ~WQS  # a1
+CASTLE_RIGHTS_KEPT[60] = 15 & ~(WKS | WQS)  # e1
+CASTLE_RIGHTS_KEPT[63] = 15 & ~WKS  # h1
+
+# each entry of GameState.undoStack packs the state a move can't give back by itself:
+# castle rights (bits 0-3), enpassant file + 1 or 0 for none (bits 4-7), halfmove clock (bits 8-23)
+# and the zobrist key (bits 24 up). The entry for a move sits at the index of the move in moveLog
+UNDO_STACK_SIZE = 512  # grows if a game goes longer
+
+MOVE_CACHE_SIZE = 4096  # positions whose legal moves are kept, 0 turns the cache off
+
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# %% --------------------------------------------------------------------------
+# Evaluation tables, kept as running totals on the GameState by makeMove and undoMove
+# -----------------------------------------------------------------------------
+
+MATERIAL_VALUES = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "P": 1}  # same as chess_computer.pieceScore
+PHASE_WEIGHTS = {"K": 0, "Q": 4, "R": 2, "B": 1, "N": 1, "P": 0}
+MAX_PHASE = 24  # all the pieces on the board, 0 is a pawn and king ending
+
+# piece square bonus in hundredths of a pawn for white, row 0 is the 8th rank like the board
+PIECE_SQUARE_MIDGAME = {
+    "P": [[0, 0, 0, 0, 0, 0, 0, 0],
+          [50, 50, 50, 50, 50, 50, 50, 50],
+          [10, 10, 20, 30, 30, 20, 10, 10],
+          [5, 5, 10, 25, 25, 10, 5, 5],
+          [0, 0, 0, 20, 20, 0, 0, 0],
+          [5, -5, -10, 0, 0, -10, -5, 5],
+          [5, 10, 10, -20, -20, 10, 10, 5],
+          [0, 0, 0, 0, 0, 0, 0, 0]],
+    "N": [[-50, -40, -30, -30, -30, -30, -40, -50],
+          [-40, -20, 0, 0, 0, 0, -20, -40],
+          [-30, 0, 10, 15, 15, 10, 0, -30],
+          [-30, 5, 15, 20, 20, 15, 5, -30],
+          [-30, 0, 15, 20, 20, 15, 0, -30],
+          [-30, 5, 10, 15, 15, 10, 5, -30],
+          [-40, -20, 0, 5, 5, 0, -20, -40],
+          [-50, -40, -30, -30, -30, -30, -40, -50]],
+    "B": [[-20, -10, -10, -10, -10, -10, -10, -20],
+          [-10, 0, 0, 0, 0, 0, 0, -10],
+          [-10, 0, 5, 10, 10, 5, 0, -10],
+          [-10, 5, 5, 10, 10, 5, 5, -10],
+          [-10, 0, 10, 10, 10, 10, 0, -10],
+          [-10, 10, 10, 10, 10, 10, 10, -10],
+          [-10, 5, 0, 0, 0, 0, 5, -10],
+          [-20, -10, -10, -10, -10, -10, -10, -20]],
+    "R": [[0, 0, 0, 0, 0, 0, 0, 0],
+          [5, 10, 10, 10, 10, 10, 10, 5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [0, 0, 0, 5, 5, 0, 0, 0]],
+    "Q": [[-20, -10, -10, -5, -5, -10, -10, -20],
+          [-10, 0, 0, 0, 0, 0, 0, -10],
+          [-10, 0, 5, 5, 5, 5, 0, -10],
+          [-5, 0, 5, 5, 5, 5, 0, -5],
+          [0, 0, 5, 5, 5, 5, 0, -5],
+          [-10, 5, 5, 5, 5, 5, 0, -10],
+          [-10, 0, 5, 0, 0, 0, 0, -10],
+          [-20, -10, -10, -5, -5, -10, -10, -20]],
+    "K": [[-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-20, -30, -30, -40, -40, -30, -30, -20],
+          [-10, -20, -20, -20, -20, -20, -20, -10],
+          [20, 20, 0, 0, 0, 0, 20, 20],
+          [20, 30, 10, 0, 0, 10, 30, 20]],
+}
+# in the endgame pawns want to run and the king wants the centre, the other pieces keep their tables
+PIECE_SQUARE_ENDGAME = dict(PIECE_SQUARE_MIDGAME)
+PIECE_SQUARE_ENDGAME["P"] = [[0, 0, 0, 0, 0, 0, 0, 0],
+                             [80, 80, 80, 80, 80, 80, 80, 80],
+                             [50, 50, 50, 50, 50, 50, 50, 50],
+                             [30, 30, 30, 30, 30, 30, 30, 30],
+                             [20, 20, 20, 20, 20, 20, 20, 20],
+                             [10, 10, 10, 10, 10, 10, 10, 10],
+                             [10, 10, 10, 10, 10, 10, 10, 10],
+                             [0, 0, 0, 0, 0, 0, 0, 0]]
+PIECE_SQUARE_ENDGAME["K"] = [[-50, -40, -30, -20, -20, -30, -40, -50],
+                             [-30, -20, -10, 0, 0, -10, -20, -30],
+                             [-30, -10, 20, 30, 30, 20, -10, -30],
+                             [-30, -10, 30, 40, 40, 30, -10, -30],
+                             [-30, -10, 30, 40, 40, 30, -10, -30],
+                             [-30, -10, 20, 30, 30, 20, -10, -30],
+                             [-30, -30, 0, 0, 0, 0, -30, -30],
+                             [-50, -30, -30, -30, -30, -30, -30, -50]]
+# by board piece and square like ZOBRIST_PIECES, black reads the white table upside down
+PIECE_SQUARE_MG = {colour + piece: [table[r if colour == "w" else 7 - r] for r in range(8)]
+                   for piece, table in PIECE_SQUARE_MIDGAME.items() for colour in "wb"}
+PIECE_SQUARE_EG = {colour + piece: [table[r if colour == "w" else 7 - r] for r in range(8)]
+                   for piece, table in PIECE_SQUARE_ENDGAME.items() for colour in "wb"}
+
+# rough piece values for ordering captures, most valuable victim then least valuable attacker
+ORDERING_VALUES = {"P": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 10}
+
+# %% --------------------------------------------------------------------------
+# Select a backend
+# -----------------------------------------------------------------------------
+
+def createGameState(backend="list"):
+    # list is the 8x8 board of strings, bitboard keeps 64 bit sets per piece but has the same interface
+    if backend == "bitboard":
+        from Chess.src.chess_bitboard import BitboardGameState  # imported here as it builds on GameState
+        return BitboardGameState()
+    return GameState()
+
 # %% --------------------------------------------------------------------------
 # GameState class
 # -----------------------------------------------------------------------------
@@ -55,13 +195,210 @@ class GameState:
         self.stalemate = False
         
         self.enpassantPossible = () # coordinates for the square where an enpassant is possible
-        self.enpassantPossibleLog = [self.enpassantPossible]
-        
-        self.currentCastleRights = CastleRights(True,True,True,True)
-        self.castleRightsLog = [CastleRights(self.currentCastleRights.wks, self.currentCastleRights.bks, 
-                                             self.currentCastleRights.wqs, self.currentCastleRights.bqs)]
+        self.castleRights = WKS | BKS | WQS | BQS # 4 bit mask, currentCastleRights gives it as a CastleRights
+        self.halfmoveClock = 0 # moves since the last capture or pawn move
+        self.startFullmove = 1 # fullmove number and side to move of the position the move log starts from
+        self.startWhiteToMove = True
+        self.undoStack = [0] * UNDO_STACK_SIZE # packed state to restore in undoMove, preallocated so makeMove doesn't allocate
+        self.nullMoveStack = []  # enpassant square and key from before each makeNullMove
+
+        self.zobristKey = self.computeZobristKey()  # updated in makeMove and undoMove
+        self.computeScores()  # material, piece square totals and game phase, also kept up to date
+        self.accumulator = None  # chess_nnue.Accumulator, kept up to date by makeMove and undoMove when set
+        self.attackMap = None  # squares attacked by the side not to move, see getAttackMap
+        self.attackMapKey = None
+
+        # legal moves of recent positions by zobrist key, least recently used dropped first
+        self.moveCache = OrderedDict()
+        self.moveCacheSize = MOVE_CACHE_SIZE
+        self.moveCacheHits = 0
+        self.moveCacheMisses = 0
+
+    @property
+    def currentCastleRights(self):
+        return CastleRights.fromMask(self.castleRights)
+
+    @currentCastleRights.setter
+    def currentCastleRights(self, rights):
+        self.castleRights = rights.toMask()
+
+    def loadFEN(self, fen):
+        # set up the position from a FEN string, the move log starts empty
+        fields = fen.split()
+        for r, rank in enumerate(fields[0].split("/")):
+            c = 0
+            for char in rank:
+                if char.isdigit():
+                    for _ in range(int(char)):
+                        self.board[r][c] = "--"
+                        c += 1
+                else:
+                    self.board[r][c] = ("w" if char.isupper() else "b") + char.upper()
+                    if char == "K":
+                        self.whiteKingLocation = (r, c)
+                    elif char == "k":
+                        self.blackKingLocation = (r, c)
+                    c += 1
+        self.whiteToMove = fields[1] == "w" if len(fields) > 1 else True
+        castle = fields[2] if len(fields) > 2 else "-"
+        self.castleRights = CastleRights("K" in castle, "k" in castle, "Q" in castle, "q" in castle).toMask()
+        enpassant = fields[3] if len(fields) > 3 else "-"
+        if enpassant == "-":
+            self.enpassantPossible = ()
+        else:
+            self.enpassantPossible = SQUARES[Move.ranksToRows[enpassant[1]] * 8 + Move.filesToCols[enpassant[0]]]
+        self.halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+        self.startFullmove = int(fields[5]) if len(fields) > 5 else 1
+        self.startWhiteToMove = self.whiteToMove
+        self.moveLog = []
+        self.checkmate = False
+        self.stalemate = False
+        self.zobristKey = self.computeZobristKey()
+        self.computeScores()
+        if self.accumulator is not None:
+            self.accumulator.refresh(self.board)
+        self.attackMap = None
+
+    def getFEN(self):
+        ranks = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for square in row:
+                if square == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += square[1] if square[0] == "w" else square[1].lower()
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        castle = "".join(char for char, right in (("K", WKS), ("Q", WQS), ("k", BKS), ("q", BQS))
+                         if self.castleRights & right)
+        enpassant = "-"
+        if self.enpassantPossible != ():
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+        # the number goes up after each black move, counted from the position loadFEN started at
+        fullmove = self.startFullmove + (len(self.moveLog) + (0 if self.startWhiteToMove else 1)) // 2
+        return "{} {} {} {} {} {}".format("/".join(ranks), "w" if self.whiteToMove else "b", castle or "-",
+                                          enpassant, self.halfmoveClock, fullmove)
+
+    def computeZobristKey(self):
+        # full hash of the position, makeMove and undoMove keep it up to date with a few xors
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] != "--":
+                    key ^= ZOBRIST_PIECES[self.board[r][c]][r][c]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLE[self.castleRights]
+        if self.enpassantPossible != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        return key
+
+    def updateZobristKey(self, move, placed, oldCastleMask, newCastleMask, oldEnpassant, newEnpassant):
+        # xor in the changes a move makes, undoMove restores the old key from the undo stack
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_PIECES[move.pieceMoved][move.startRow][move.startCol]
+        key ^= ZOBRIST_PIECES[placed][move.endRow][move.endCol]  # promoted piece if it was a promotion
+        if move.pieceCaptured != "--":
+            if move.isEnpassantMove:
+                key ^= ZOBRIST_PIECES[move.pieceCaptured][move.startRow][move.endCol]
+            else:
+                key ^= ZOBRIST_PIECES[move.pieceCaptured][move.endRow][move.endCol]
+        elif move.isCastleMove:
+            rookKeys = ZOBRIST_PIECES[move.pieceMoved[0] + "R"][move.endRow]
+            if move.endCol - move.startCol == 2:  # King side
+                key ^= rookKeys[move.endCol + 1] ^ rookKeys[move.endCol - 1]
+            else:
+                key ^= rookKeys[move.endCol - 2] ^ rookKeys[move.endCol + 1]
+        if oldCastleMask != newCastleMask:
+            key ^= ZOBRIST_CASTLE[oldCastleMask] ^ ZOBRIST_CASTLE[newCastleMask]
+        if oldEnpassant != ():
+            key ^= ZOBRIST_ENPASSANT[oldEnpassant[1]]
+        if newEnpassant != ():
+            key ^= ZOBRIST_ENPASSANT[newEnpassant[1]]
+        self.zobristKey = key
+
+    def computeScores(self):
+        # totals per colour from scratch, makeMove and undoMove add and take away the changes
+        self.material = {"w": 0, "b": 0}
+        self.nonPawnMaterial = {"w": 0, "b": 0}  # a side with only pawns can be in zugzwang
+        self.pstMidgame = {"w": 0, "b": 0}
+        self.pstEndgame = {"w": 0, "b": 0}
+        self.gamePhase = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    self.material[piece[0]] += MATERIAL_VALUES[piece[1]]
+                    if piece[1] != "P":
+                        self.nonPawnMaterial[piece[0]] += MATERIAL_VALUES[piece[1]]
+                    self.pstMidgame[piece[0]] += PIECE_SQUARE_MG[piece][r][c]
+                    self.pstEndgame[piece[0]] += PIECE_SQUARE_EG[piece][r][c]
+                    self.gamePhase += PHASE_WEIGHTS[piece[1]]
+
+    def updateScores(self, move, placed, sign):
+        # sign is 1 in makeMove and -1 in undoMove, placed is the promoted piece if it was a promotion
+        colour = move.pieceMoved[0]
+        midgame = PIECE_SQUARE_MG[placed][move.endRow][move.endCol] - \
+            PIECE_SQUARE_MG[move.pieceMoved][move.startRow][move.startCol]
+        endgame = PIECE_SQUARE_EG[placed][move.endRow][move.endCol] - \
+            PIECE_SQUARE_EG[move.pieceMoved][move.startRow][move.startCol]
+        if move.isPawnPromotion:
+            self.material[colour] += sign * (MATERIAL_VALUES[placed[1]] - MATERIAL_VALUES["P"])
+            self.nonPawnMaterial[colour] += sign * MATERIAL_VALUES[placed[1]]
+            self.gamePhase += sign * PHASE_WEIGHTS[placed[1]]
+        if move.isCastleMove:
+            rook = colour + "R"
+            if move.endCol - move.startCol == 2:  # King side
+                rookFrom, rookTo = move.endCol + 1, move.endCol - 1
+            else:
+                rookFrom, rookTo = move.endCol - 2, move.endCol + 1
+            midgame += PIECE_SQUARE_MG[rook][move.endRow][rookTo] - PIECE_SQUARE_MG[rook][move.endRow][rookFrom]
+            endgame += PIECE_SQUARE_EG[rook][move.endRow][rookTo] - PIECE_SQUARE_EG[rook][move.endRow][rookFrom]
+        self.pstMidgame[colour] += sign * midgame
+        self.pstEndgame[colour] += sign * endgame
+
+        captured = move.pieceCaptured
+        if captured != "--":
+            enemy = captured[0]
+            r = move.startRow if move.isEnpassantMove else move.endRow
+            self.material[enemy] -= sign * MATERIAL_VALUES[captured[1]]
+            if captured[1] != "P":
+                self.nonPawnMaterial[enemy] -= sign * MATERIAL_VALUES[captured[1]]
+            self.pstMidgame[enemy] -= sign * PIECE_SQUARE_MG[captured][r][move.endCol]
+            self.pstEndgame[enemy] -= sign * PIECE_SQUARE_EG[captured][r][move.endCol]
+            self.gamePhase -= sign * PHASE_WEIGHTS[captured[1]]
+
+    def saveUndoState(self):
+        # save what can't be worked out from the move when undoing it, before the move goes in the log
+        ply = len(self.moveLog)
+        if ply == len(self.undoStack):
+            self.undoStack.extend([0] * len(self.undoStack))
+        self.undoStack[ply] = self.castleRights | \
+            (self.enpassantPossible[1] + 1 if self.enpassantPossible != () else 0) << 4 | \
+            self.halfmoveClock << 8 | self.zobristKey << 24
+
+    def restoreUndoState(self):
+        # give back castle rights, enpassant, halfmove clock and key, after the move is taken off the log
+        state = self.undoStack[len(self.moveLog)]
+        self.castleRights = state & 15
+        enpassantFile = (state >> 4 & 15) - 1
+        if enpassantFile < 0:
+            self.enpassantPossible = ()
+        else:
+            self.enpassantPossible = SQUARES[(2 if self.whiteToMove else 5) * 8 + enpassantFile]
+        self.halfmoveClock = state >> 8 & 0xFFFF
+        self.zobristKey = state >> 24
 
     def makeMove(self, move):
+        oldCastleMask = self.castleRights
+        oldEnpassant = self.enpassantPossible
+        self.saveUndoState()
 
         self.board[move.endRow][move.endCol] = move.pieceMoved
         self.board[move.startRow][move.startCol] = "--"  # replace piece with empty square
@@ -70,26 +407,28 @@ class GameState:
         self.whiteToMove = not self.whiteToMove  # swap player
         # track king
         if move.pieceMoved == "wK":
-            self.whiteKingLocation = (move.endRow, move.endCol)
+            self.whiteKingLocation = SQUARES[move.endRow * 8 + move.endCol]
         elif move.pieceMoved == "bK":
-            self.blackKingLocation = (move.endRow, move.endCol)
-            
+            self.blackKingLocation = SQUARES[move.endRow * 8 + move.endCol]
+
+        if move.pieceMoved[1] == "P" or move.pieceCaptured != "--":
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
         
         # enpassant move: If pawn move 2 squares next move can be an en passant
         if move.pieceMoved[1] == "P" and abs(move.startRow - move.endRow) == 2:
-            self.enpassantPossible = ((move.startRow + move.endRow)//2, move.startCol)
+            self.enpassantPossible = SQUARES[(move.startRow + move.endRow) // 2 * 8 + move.startCol]
         else:
             self.enpassantPossible = ()
         if move.isEnpassantMove:
             self.board[move.startRow][move.endCol] = "--"    
-        self.enpassantPossibleLog.append(self.enpassantPossible)
         
         
         # pawn promotion
-        #TODO workout how to impliment pawnpromotion with computer prediction
         if move.isPawnPromotion:
-            promotedPiece = "Q"#input("Promote to Q, R, B or N:") # can add UI to make it better
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + promotedPiece # modify if you want to give option of other pieces
+            promotedPiece = move.promotionPiece # the generators give a move for each piece, the UI takes the queen
+            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + promotedPiece
         
         
         # TODO move to king function - rather than moving pieces in here
@@ -103,8 +442,15 @@ class GameState:
                 self.board[move.endRow][move.endCol-2] = "--" # move rook                
         # Castling rights
         self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.currentCastleRights.wks, self.currentCastleRights.bks, 
-                                             self.currentCastleRights.wqs, self.currentCastleRights.bqs))
+        placed = self.board[move.endRow][move.endCol]
+        self.updateZobristKey(move, placed, oldCastleMask, self.castleRights, oldEnpassant, self.enpassantPossible)
+        self.updateScores(move, placed, 1)
+        if self.accumulator is not None:
+            self.accumulator.push(move, placed)
+
+    def makeMoveCode(self, code):
+        # what the search calls, only the moves it plays become Move objects (for the move log)
+        self.makeMove(Move.fromCode(code, self.board))
 
     def undoMove(self):
 
@@ -114,24 +460,22 @@ class GameState:
             self.board[move.endRow][move.endCol] = move.pieceCaptured  # replace captured piece
             self.whiteToMove = not self.whiteToMove  # swap player
             
-            # track king
+            # track king, back to where it started
             if move.pieceMoved == "wK":
-                self.whiteKingLocation = (move.endRow, move.endCol)
+                self.whiteKingLocation = SQUARES[move.startRow * 8 + move.startCol]
             elif move.pieceMoved == "bK":
-                self.blackKingLocation = (move.endRow, move.endCol)
+                self.blackKingLocation = SQUARES[move.startRow * 8 + move.startCol]
                 
             # undo enpassant move
             if move.isEnpassantMove:
                 self.board[move.endRow][move.endCol] = "--" # leave the landing square blank
                 self.board[move.startRow][move.endCol] = move.pieceCaptured
             
-            self.enpassantPossibleLog.pop() # remove enpassant rights from log
-            self.enpassantPossible = self.enpassantPossibleLog[-1]
-
-            # give back castle rights
-            self.castleRightsLog.pop() # remove castling rights from log
-            newRights = self.castleRightsLog[-1]
-            self.currentCastleRights = CastleRights(newRights.wks, newRights.bks, newRights.wqs, newRights.bqs) # set rights to the new last entry of log
+            self.restoreUndoState()
+            self.updateScores(move, move.pieceMoved[0] + move.promotionPiece if move.isPawnPromotion
+                              else move.pieceMoved, -1)
+            if self.accumulator is not None:
+                self.accumulator.pop()
             
             # TODO move to king function - rather than moving pieces in here
             if move.isCastleMove:
@@ -145,10 +489,56 @@ class GameState:
             self.checkmate = False
             self.stalemate = False
 
+    def makeNullMove(self):
+        # pass the turn without moving, for null move pruning in the search. Not put in the move log,
+        # undoNullMove has to be called before the move before it is undone
+        self.nullMoveStack.append((self.enpassantPossible, self.zobristKey))
+        if self.enpassantPossible != ():
+            self.zobristKey ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+            self.enpassantPossible = ()
+        self.zobristKey ^= ZOBRIST_BLACK_TO_MOVE
+        self.whiteToMove = not self.whiteToMove
+
+    def undoNullMove(self):
+        self.enpassantPossible, self.zobristKey = self.nullMoveStack.pop()
+        self.whiteToMove = not self.whiteToMove
+        self.checkmate = False
+        self.stalemate = False
+
     def getValidMoves(self):
-    # Checking move is legal
+        # legal moves as Move objects for the UI and the root of the search, built from getValidMoveCodes
+        board = self.board
+        return [Move.fromCode(code, board) for code in self.getValidMoveCodes()]
+
+    def getValidMoveCodes(self):
+        # legal moves as an array of 16 bit codes (see encodeMove), from the cache if this position has
+        # been seen recently (undo, transpositions)
+        cached = self.moveCache.get(self.zobristKey)
+        if cached is not None:
+            self.moveCacheHits += 1
+            self.moveCache.move_to_end(self.zobristKey)
+            codes, self.inCheck, self.checkmate, self.stalemate = cached
+            return array("H", codes) # a copy, callers change their list
+        self.moveCacheMisses += 1
+        codes = self.generateValidMoves()
+        self.storeValidMoves(codes)
+        return codes
+
+    def storeValidMoves(self, codes):
+        if self.moveCacheSize > 0:
+            self.moveCache[self.zobristKey] = (array("H", codes), self.inCheck, self.checkmate, self.stalemate)
+            if len(self.moveCache) > self.moveCacheSize:
+                self.moveCache.popitem(last=False)
+
+    def getMoveCacheStats(self):
+        lookups = self.moveCacheHits + self.moveCacheMisses
+        return {"hits": self.moveCacheHits, "misses": self.moveCacheMisses, "size": len(self.moveCache),
+                "hitRate": self.moveCacheHits / lookups if lookups else 0.0}
 
-        moves = []
+    def generateValidMoves(self):
+    # Checking move is legal, the moves are codes in an array
+
+        moves = array("H")
         self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
         if self.whiteToMove:
             kingRow = self.whiteKingLocation[0]
@@ -176,9 +566,12 @@ class GameState:
                         if validSquare[0]== checkRow and validSquare[1] == checkCol:
                             break 
                 for i in range(len(moves) - 1, -1, -1): # go through list backward as removing items from list
-                    if moves[i].pieceMoved[1] != "K":
-                        if not (moves[i].endRow,moves[i].endCol) in validSquares:
-                            moves.remove(moves[i])                  
+                    startRow, startCol = SQUARES[moves[i] & 63]
+                    if self.board[startRow][startCol][1] != "K":
+                        # enpassant can take the checking pawn without landing on its square
+                        if not SQUARES[moves[i] >> 6 & 63] in validSquares and \
+                            not (moves[i] & 0x3000 == MOVE_ENPASSANT and (startRow, moves[i] >> 6 & 7) == (checkRow, checkCol)):
+                            del moves[i]
             else: # double check
                 self.getKingMoves(kingRow, kingCol, moves)
         else: # not in check
@@ -189,7 +582,7 @@ class GameState:
 
         
         if len(moves) == 0:
-            if self.incheck():
+            if self.inCheck:
                 self.checkmate = True
                 #print("checkmate")
             else:
@@ -203,10 +596,205 @@ class GameState:
 
         return moves
         
+    def movePieces(self, code):
+        # the piece a move code moves and the piece it takes, enpassant takes the pawn beside the end square
+        startRow, startCol = SQUARES[code & 63]
+        if code & 0x3000 == MOVE_ENPASSANT:
+            return self.board[startRow][startCol], "bP" if self.whiteToMove else "wP"
+        endRow, endCol = SQUARES[code >> 6 & 63]
+        return self.board[startRow][startCol], self.board[endRow][endCol]
+
+    def captureOrderKey(self, code):
+        # higher first, most valuable victim then least valuable attacker. Promotions count as winning the piece
+        pieceMoved, pieceCaptured = self.movePieces(code)
+        victim = ORDERING_VALUES[pieceCaptured[1]] if pieceCaptured != "--" else 0
+        if code & 0x3000 == MOVE_PROMOTION:
+            victim += ORDERING_VALUES[PROMOTION_PIECES[code >> 14]] - 1
+        return victim * 16 - ORDERING_VALUES[pieceMoved[1]]
+
+    def moveOrderKey(self, code, hashMove=None, killers=(), history=None):
+        # same order as the stages of generateMoveCodesStaged, for when the whole list is sorted at once
+        if code == hashMove:
+            return 4, 0
+        pieceMoved, pieceCaptured = self.movePieces(code)
+        isPromotion = code & 0x3000 == MOVE_PROMOTION
+        if pieceCaptured != "--" or isPromotion:
+            key = self.captureOrderKey(code)
+            if isPromotion or pieceMoved[1] == "K" or ORDERING_VALUES[pieceCaptured[1]] >= ORDERING_VALUES[pieceMoved[1]]:
+                return 3, key
+            return 0, key  # losing capture
+        if code in killers:
+            return 2, 0
+        return 1, history[code & 0xFFF] if history is not None else 0
+
+    def generateMoveCodesStaged(self, hashMove=None, killers=(), history=None):
+        # yields the legal move codes a stage at a time: hash move, winning captures, promotions, killer
+        # moves (quiet move codes that cut off at this ply before), the other quiet moves by their history
+        # score (list indexed by the low 12 bits of the code), castling and then losing captures.
+        # A stage is only generated when the caller asks for its first move, so a search that cuts off
+        # early never builds the rest of the list
+        ally = "w" if self.whiteToMove else "b"
+        if self.zobristKey in self.moveCache or self.incheck():
+            # already cached, or few moves get out of check, so use the full list. getValidMoveCodes sets checkmate
+            yield from sorted(self.getValidMoveCodes(), key=lambda code: self.moveOrderKey(code, hashMove, killers, history),
+                              reverse=True)
+            return
+
+        yielded = array("H")
+        skipCodes = set()  # hash move and killers already tried
+        if hashMove is not None and self.isLegalCode(hashMove, ally):
+            skipCodes.add(hashMove)
+            yielded.append(hashMove)
+            yield hashMove
+
+        captures = sorted(self.getCaptureCodes(includePromotions=True), key=self.captureOrderKey, reverse=True)
+        winning = []
+        promotions = []
+        losing = []
+        for code in captures:
+            if skipCodes and code in skipCodes:
+                continue
+            pieceMoved, pieceCaptured = self.movePieces(code)
+            if pieceCaptured == "--":
+                promotions.append(code)
+            elif ORDERING_VALUES[pieceCaptured[1]] >= ORDERING_VALUES[pieceMoved[1]] or pieceMoved[1] == "K":
+                winning.append(code)  # a legal king capture is never recaptured
+            else:
+                losing.append(code)
+        for code in winning + promotions:
+            yielded.append(code)
+            yield code
+
+        for killer in killers:
+            if killer and killer not in skipCodes and killer & 0x3000 != MOVE_PROMOTION and \
+                    self.movePieces(killer)[1] == "--" and self.isLegalCode(killer, ally):
+                skipCodes.add(killer)
+                yielded.append(killer)
+                yield killer
+
+        quiets = self.getQuietCodes()
+        if history is not None:
+            quiets = sorted(quiets, key=lambda code: history[code & 0xFFF], reverse=True)
+        for stage in (quiets, self.getCastleCodes()):
+            for code in stage:
+                if not skipCodes or code not in skipCodes:
+                    yielded.append(code)
+                    yield code
+
+        for code in losing:
+            yielded.append(code)
+            yield code
+
+        # every stage was used so the full list can go in the cache
+        self.inCheck = False
+        self.checkmate = False
+        self.stalemate = len(yielded) == 0
+        self.storeValidMoves(yielded)
+
+    def isLegalCode(self, code, ally):
+        # is the move code legal here, only generates the moves of one piece. Not for use in check
+        if self.movePieces(code)[0][0] != ally:
+            return False
+        r, c = SQUARES[code & 63]
+        return code in (self.getCastleCodes() if code & 0x3000 == MOVE_CASTLE else self.getCodesFrom(r, c))
+
+    def getCodesFrom(self, r, c):
+        # legal moves of the piece on (r, c) when not in check, castling not included
+        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        moves = array("H")
+        self.moveFunctions[self.board[r][c][1]](r, c, moves)
+        return moves
+
+    def getQuietCodes(self):
+        # legal moves that don't capture or promote, castling not included. Only used when not in check
+        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        board = self.board
+        return array("H", [code for code in self.getAllPossibleMoves() if code & 0x3000 == MOVE_NORMAL and
+                           board[code >> 9 & 7][code >> 6 & 7] == "--"])
+
+    def getCastleCodes(self):
+        self.inCheck = self.checkForPinsAndChecks()[0]
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        moves = array("H")
+        self.getCastleMoves(kingRow, kingCol, moves)
+        return moves
+
+    def getCaptureCodes(self, includePromotions=False):
+        # legal captures (and pawn pushes that promote if asked) without generating any quiet moves
+        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        if self.inCheck:
+            return array("H", [code for code in self.getValidMoveCodes() if self.movePieces(code)[1] != "--" or
+                               (includePromotions and code & 0x3000 == MOVE_PROMOTION)])
+
+        board = self.board
+        allyColour = "w" if self.whiteToMove else "b"
+        enemyColour = "b" if self.whiteToMove else "w"
+        pinDirections = {(pin[0], pin[1]): (pin[2], pin[3]) for pin in self.pins}
+        orthogonal = ((-1, 0), (0, -1), (1, 0), (0, 1))
+        diagonal = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+        sliders = {"R": orthogonal, "B": diagonal, "Q": orthogonal + diagonal}
+        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+        moves = array("H")
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c]
+                if piece[0] != allyColour:
+                    continue
+                type = piece[1]
+                pinDirection = pinDirections.get((r, c))
+                if type == "P":
+                    moveAmount = -1 if allyColour == "w" else 1
+                    pawnPromotion = r + moveAmount == (0 if allyColour == "w" else 7)
+                    for dc in (-1, 1):
+                        endCol = c + dc
+                        if 0 <= endCol < 8 and (pinDirection is None or pinDirection == (moveAmount, dc)):
+                            if board[r + moveAmount][endCol][0] == enemyColour:
+                                self.addPawnMove(r * 8 + c, (r + moveAmount) * 8 + endCol, moves, pawnPromotion)
+                            elif (r + moveAmount, endCol) == self.enpassantPossible and not self.enpassantExposesKing(r, c, endCol):
+                                moves.append(r * 8 + c | ((r + moveAmount) * 8 + endCol) << 6 | MOVE_ENPASSANT)
+                    if includePromotions and pawnPromotion and board[r + moveAmount][c] == "--" and \
+                        (pinDirection is None or pinDirection == (moveAmount, 0)):
+                        self.addPawnMove(r * 8 + c, (r + moveAmount) * 8 + c, moves, True)
+                elif type == "N":
+                    if pinDirection is not None:
+                        continue
+                    for m in knightMoves:
+                        endRow = r + m[0]
+                        endCol = c + m[1]
+                        if 0 <= endRow < 8 and 0 <= endCol < 8 and board[endRow][endCol][0] == enemyColour:
+                            moves.append(r * 8 + c | (endRow * 8 + endCol) << 6)
+                elif type == "K":
+                    safeCaptures = []
+                    board[r][c] = "--"  # lift the king so it doesn't block a slider behind it
+                    for d in orthogonal + diagonal:
+                        endRow = r + d[0]
+                        endCol = c + d[1]
+                        if 0 <= endRow < 8 and 0 <= endCol < 8 and board[endRow][endCol][0] == enemyColour and \
+                            not self.squareAttackedBy(endRow, endCol, enemyColour):
+                            safeCaptures.append(endRow * 8 + endCol)
+                    board[r][c] = piece
+                    for endSq in safeCaptures:
+                        moves.append(r * 8 + c | endSq << 6)
+                else:
+                    for d in sliders[type]:
+                        if pinDirection is not None and pinDirection != d and pinDirection != (-d[0], -d[1]):
+                            continue
+                        for i in range(1, 8):
+                            endRow = r + d[0] * i
+                            endCol = c + d[1] * i
+                            if not (0 <= endRow < 8 and 0 <= endCol < 8):
+                                break
+                            endPiece = board[endRow][endCol]
+                            if endPiece != "--":
+                                if endPiece[0] == enemyColour:
+                                    moves.append(r * 8 + c | (endRow * 8 + endCol) << 6)
+                                break
+        return moves
+
     def getAllPossibleMoves(self):
-    # Create moves each piece can play
+    # Create moves each piece can play, as move codes
 
-        moves = []
+        moves = array("H")
         for r in range(len(self.board)):
             for c in range(len(self.board[r])):
                 turn = self.board[r][c][0]  # Which colour piece you are looking at
@@ -291,24 +879,84 @@ class GameState:
         return inCheck, pins, checks
                                        
     def incheck(self):
-        if self.whiteToMove:
-            return self.squareUnderAttack(
-                self.whiteKingLocation[0], self.whiteKingLocation[1]
-            )
-        else:
-            return self.squareUnderAttack(
-                self.blackKingLocation[0], self.blackKingLocation[1]
-            )
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        if self.attackMapKey == self.zobristKey and self.attackMap is not None:
+            return self.attackMap[kingRow][kingCol]  # reuse the map castling already built
+        return self.squareUnderAttack(kingRow, kingCol)
 
     def squareUnderAttack(self, r, c):
-        self.whiteToMove = not self.whiteToMove  # switch to get opponents moves
-        oppMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove  # switch back
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c:  # square is being attacked
+        # is the square attacked by the opponent of the side to move
+        return self.squareAttackedBy(r, c, "b" if self.whiteToMove else "w")
+
+    def squareAttackedBy(self, r, c, enemyColour):
+        # probe outwards from the square instead of generating the enemy moves
+        directions = ((-1,0), (0,-1), (1,0), (0,1),
+                      (-1,-1), (-1,1), (1,-1), (1,1))
+        for j in range(len(directions)):
+            d = directions[j]
+            for i in range(1,8):
+                endRow = r + d[0] * i
+                endCol = c + d[1] * i
+                if not (0 <= endRow < 8 and 0 <= endCol < 8):
+                    break
+                endPiece = self.board[endRow][endCol]
+                if endPiece == "--":
+                    continue
+                if endPiece[0] == enemyColour:
+                    type = endPiece[1]
+                    if (type == "Q") or (j <= 3 and type == "R") or (j >= 4 and type == "B") or \
+                        (i == 1 and type == "K"):
+                        return True
+                    # pawns attack diagonally forwards so look back towards them
+                    if i == 1 and type == "P" and ((enemyColour == "w" and j >= 6) or (enemyColour == "b" and 4 <= j <= 5)):
+                        return True
+                break
+        knightMoves = ((-2,-1), (-2,1), (-1,-2), (-1,2),
+                       (1,-2), (1,2), (2,-1), (2,1))
+        for m in knightMoves:
+            endRow = r + m[0]
+            endCol = c + m[1]
+            if 0 <= endRow < 8 and 0 <= endCol < 8 and self.board[endRow][endCol] == enemyColour + "N":
                 return True
-        return False        
-    
+        return False
+
+    def getAttackMap(self):
+        # 8x8 map of squares the opponent of the side to move attacks, kept until the position changes
+        if self.attackMapKey == self.zobristKey and self.attackMap is not None:
+            return self.attackMap
+        enemyColour = "b" if self.whiteToMove else "w"
+        attacked = [[False] * 8 for _ in range(8)]
+        rays = {"R": ((-1,0), (0,-1), (1,0), (0,1)),
+                "B": ((-1,-1), (-1,1), (1,-1), (1,1)),
+                "Q": ((-1,0), (0,-1), (1,0), (0,1), (-1,-1), (-1,1), (1,-1), (1,1))}
+        steps = {"N": ((-2,-1), (-2,1), (-1,-2), (-1,2), (1,-2), (1,2), (2,-1), (2,1)),
+                 "K": ((-1,-1), (-1,0), (-1,1), (0,-1), (0,1), (1,-1), (1,0), (1,1)),
+                 "P": ((-1,-1), (-1,1)) if enemyColour == "w" else ((1,-1), (1,1))}
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece[0] != enemyColour:
+                    continue
+                if piece[1] in rays:
+                    for d in rays[piece[1]]:
+                        for i in range(1,8):
+                            endRow = r + d[0] * i
+                            endCol = c + d[1] * i
+                            if not (0 <= endRow < 8 and 0 <= endCol < 8):
+                                break
+                            attacked[endRow][endCol] = True
+                            if self.board[endRow][endCol] != "--":
+                                break
+                else:
+                    for m in steps[piece[1]]:
+                        endRow = r + m[0]
+                        endCol = c + m[1]
+                        if 0 <= endRow < 8 and 0 <= endCol < 8:
+                            attacked[endRow][endCol] = True
+        self.attackMap = attacked
+        self.attackMapKey = self.zobristKey
+        return attacked
+
     def getKingMoves(self, r, c, moves):
         rowMoves = (-1,-1,-1,0,0,1,1,1)
         colMoves = (-1,0,1,-1,1,-1,0,1)
@@ -326,7 +974,7 @@ class GameState:
                         self.blackKingLocation = (endRow, endCol)
                     inCheck, pins, checks = self.checkForPinsAndChecks()
                     if not inCheck:
-                        moves.append(Move((r,c),(endRow,endCol), self.board))
+                        moves.append(r * 8 + c | (endRow * 8 + endCol) << 6)
                     # place king back on orignal location
                     if allyColour == "w":
                         self.whiteKingLocation = (r,c)
@@ -334,56 +982,28 @@ class GameState:
                         self.blackKingLocation = (r,c)
     
     def getCastleMoves(self, r, c, moves):
-        if self.squareUnderAttack(r, c):
-            return # Can't castle in check
-        if (self.whiteToMove and self.currentCastleRights.wks) or (not self.whiteToMove and self.currentCastleRights.bks):
+        if self.inCheck:
+            return # Can't castle in check, already worked out in checkForPinsAndChecks
+        if self.castleRights & (WKS if self.whiteToMove else BKS):
             self.getKingSideCastleMoves(r, c, moves)
             
-        if (self.whiteToMove and self.currentCastleRights.wqs) or (not self.whiteToMove and self.currentCastleRights.bqs):
+        if self.castleRights & (WQS if self.whiteToMove else BQS):
             self.getQueenSideCastleMoves(r, c, moves)
     
     def getKingSideCastleMoves(self, r, c, moves): 
         if self.board[r][c+1] == "--" and self.board[r][c+2] == "--" and \
-        not self.squareUnderAttack(r, c+1) and not self.squareUnderAttack(r, c + 2):
-            moves.append(Move((r,c), (r, c+2),self.board, isCastleMove = True))
+        not self.getAttackMap()[r][c+1] and not self.getAttackMap()[r][c+2]:
+            moves.append(r * 8 + c | (r * 8 + c + 2) << 6 | MOVE_CASTLE)
             
     def getQueenSideCastleMoves(self, r, c, moves):
         if self.board[r][c-1] == "--" and self.board[r][c-2] == "--" and self.board[r][c-3] == "--" and \
-        not self.squareUnderAttack(r, c - 1) and not self.squareUnderAttack(r, c - 2):
-            moves.append(Move((r,c), (r, c - 2),self.board, isCastleMove = True))
+        not self.getAttackMap()[r][c-1] and not self.getAttackMap()[r][c-2]:
+            moves.append(r * 8 + c | (r * 8 + c - 2) << 6 | MOVE_CASTLE)
                       
     def updateCastleRights(self, move):
-        if move.pieceMoved == "wK":
-            self.currentCastleRights.wks = False
-            self.currentCastleRights.wqs = False
-        elif move.pieceMoved == "bK":
-            self.currentCastleRights.bks = False
-            self.currentCastleRights.bqs = False        
-        elif move.pieceMoved == "wR":
-            if move.startRow == 7:
-                if move.startCol == 7: 
-                    self.currentCastleRights.wks = False
-                elif move.startCol == 0:
-                    self.currentCastleRights.wqs = False        
-        elif move.pieceMoved == "bR":
-                if move.startCol == 7: 
-                    self.currentCastleRights.bks = False
-                elif move.startCol == 0:
-                    self.currentCastleRights.bqs = False 
-                    
-        # if rook is captured   
-        if move.pieceCaptured == "wR":
-            if move.endRow == 7:
-                if move.endCol == 0:
-                    self.currentCastleRights.wqs = False
-                if move.endCol == 7:
-                    self.currentCastleRights.wks = False                    
-        elif move.pieceCaptured == "bR":
-            if move.endRow == 0:
-                if move.endCol == 0:
-                    self.currentCastleRights.bqs = False
-                if move.endCol == 7:
-                    self.currentCastleRights.bks = False                     
+        # moving the king or a rook, or capturing a rook, from its starting square loses the rights
+        self.castleRights &= CASTLE_RIGHTS_KEPT[move.startRow * 8 + move.startCol] & \
+            CASTLE_RIGHTS_KEPT[move.endRow * 8 + move.endCol]
     
     def getQueenMoves(self, r, c, moves):
         
@@ -409,9 +1029,9 @@ class GameState:
                     if not piecePinned or pinDirection == d or pinDirection == (-d[0],-d[1]):
                         endPiece = self.board[endRow][endCol]
                         if endPiece == "--":  # no piece so keep searching
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
+                            moves.append(r * 8 + c | (endRow * 8 + endCol) << 6)
                         elif endPiece[0] == enemyColour:  # a piece you can capture
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
+                            moves.append(r * 8 + c | (endRow * 8 + endCol) << 6)
                             break
                         else:  # piece you can't take
                             break
@@ -441,9 +1061,9 @@ class GameState:
                     if not piecePinned or pinDirection == d or pinDirection == (-d[0],-d[1]):
                         endPiece = self.board[endRow][endCol]
                         if endPiece == "--":  # no piece so keep searching
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
+                            moves.append(r * 8 + c | (endRow * 8 + endCol) << 6)
                         elif endPiece[0] == enemyColour:  # a piece you can capture
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
+                            moves.append(r * 8 + c | (endRow * 8 + endCol) << 6)
                             break
                         else:  # piece you can't take
                             break
@@ -480,7 +1100,7 @@ class GameState:
             
                     endPiece = self.board[endRow][endCol]
                     if (endPiece[0] == enemyColour or endPiece == "--"):  # a piece you can capture
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
+                        moves.append(r * 8 + c | (endRow * 8 + endCol) << 6)
 
     def getBishopMoves(self, r, c, moves):
         piecePinned = False
@@ -502,9 +1122,9 @@ class GameState:
                     if not piecePinned or pinDirection ==d or pinDirection == (-d[0], -d[1]):
                         endPiece = self.board[endRow][endCol]
                         if endPiece == "--":  # no piece so keep searching
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
+                            moves.append(r * 8 + c | (endRow * 8 + endCol) << 6)
                         elif endPiece[0] == enemyColour:  # a piece you can capture
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
+                            moves.append(r * 8 + c | (endRow * 8 + endCol) << 6)
                             break
                         else:  # piece you can't take
                             break
@@ -540,10 +1160,10 @@ class GameState:
             if not piecePinned or pinDirection == (moveAmount,0):
                 if r + moveAmount == backRow: # if pawn gets to back row it will promote
                     pawnPromotion = True
-                moves.append(Move((r, c), (r + moveAmount, c), self.board, isPawnPromotion = pawnPromotion))
+                self.addPawnMove(r * 8 + c, (r + moveAmount) * 8 + c, moves, pawnPromotion)
                 
                 if r == startRow and self.board[r + 2 * moveAmount][c] == "--": # 2 square move
-                    moves.append(Move((r, c), (r + 2 * moveAmount, c), self.board))
+                    moves.append(r * 8 + c | ((r + 2 * moveAmount) * 8 + c) << 6)
                     
         # capture to left
         if c - 1 >= 0:  # not at the edge of the board
@@ -551,10 +1171,10 @@ class GameState:
                 if (self.board[r + moveAmount][c - 1][0] == enemyColour):  # there is a black piece that can be captured
                     if r + moveAmount == backRow: # if pawn gets to back row it will promote
                         pawnPromotion = True
-                    moves.append(Move((r, c), (r + moveAmount, c -1), self.board, isPawnPromotion = pawnPromotion))
+                    self.addPawnMove(r * 8 + c, (r + moveAmount) * 8 + c - 1, moves, pawnPromotion)
                     
-                if (r + moveAmount, c - 1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r + moveAmount, c - 1), self.board, isEnpassantMove = True))
+                if (r + moveAmount, c - 1) == self.enpassantPossible and not self.enpassantExposesKing(r, c, c - 1):
+                    moves.append(r * 8 + c | ((r + moveAmount) * 8 + c - 1) << 6 | MOVE_ENPASSANT)
 
         # capture to right
         if c + 1 <= 7:  # not at the edge of the board
@@ -562,11 +1182,33 @@ class GameState:
                 if (self.board[r + moveAmount][c + 1][0] == enemyColour):  # there is a black piece that can be captured
                     if r + moveAmount == backRow: # if pawn gets to back row it will promote
                         pawnPromotion = True
-                    moves.append(Move((r, c), (r + moveAmount, c + 1), self.board, isPawnPromotion = pawnPromotion))
-                if (r + moveAmount, c + 1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r + moveAmount, c + 1), self.board, isEnpassantMove = True))
+                    self.addPawnMove(r * 8 + c, (r + moveAmount) * 8 + c + 1, moves, pawnPromotion)
+                if (r + moveAmount, c + 1) == self.enpassantPossible and not self.enpassantExposesKing(r, c, c + 1):
+                    moves.append(r * 8 + c | ((r + moveAmount) * 8 + c + 1) << 6 | MOVE_ENPASSANT)
 
+    def addPawnMove(self, startSq, endSq, moves, pawnPromotion):
+        # a pawn reaching the back row gives one move for each piece it can promote to, queen first
+        if pawnPromotion:
+            for piece in range(len(PROMOTION_PIECES)):
+                moves.append(startSq | endSq << 6 | MOVE_PROMOTION | piece << 14)
+        else:
+            moves.append(startSq | endSq << 6)
             
+    def enpassantExposesKing(self, r, c, capturedCol):
+        # both pawns leave the row at once, so a rook or queen along the row can see the king
+        # which checkForPinsAndChecks can't spot as it only looks for single pinned pieces
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        if kingRow != r:
+            return False
+        enemyColour = "b" if self.whiteToMove else "w"
+        step = 1 if kingCol < c else -1
+        col = kingCol + step
+        while 0 <= col < 8:
+            if col != c and col != capturedCol and self.board[r][col] != "--":
+                return self.board[r][col][0] == enemyColour and self.board[r][col][1] in ("R", "Q")
+            col += step
+        return False
+
 # %% --------------------------------------------------------------------------
 # CastleRights class
 # -----------------------------------------------------------------------------
@@ -578,6 +1220,31 @@ class CastleRights():
         self.wqs = wqs
         self.bqs = bqs
 
+    def toMask(self):
+        # 4 bit number, one bit per right
+        return self.wks | self.bks << 1 | self.wqs << 2 | self.bqs << 3
+
+    @staticmethod
+    def fromMask(mask):
+        return CastleRights(bool(mask & WKS), bool(mask & BKS), bool(mask & WQS), bool(mask & BQS))
+
+
+# %% --------------------------------------------------------------------------
+# Compact move encoding
+# -----------------------------------------------------------------------------
+
+# a move fits in 16 bits: start square (bits 0-5), end square (bits 6-11),
+# move type (bits 12-13) and promotion piece (bits 14-15). Squares are row * 8 + col
+MOVE_NORMAL = 0
+MOVE_PROMOTION = 1 << 12
+MOVE_ENPASSANT = 2 << 12
+MOVE_CASTLE = 3 << 12
+PROMOTION_PIECES = "QRBN"
+SQUARES = [(sq >> 3, sq & 7) for sq in range(64)]  # square index to (row, col)
+
+
+def encodeMove(startSq, endSq, moveType=MOVE_NORMAL, promotionPiece="Q"):
+    return startSq | endSq << 6 | moveType | PROMOTION_PIECES.index(promotionPiece) << 14
 
 # %% --------------------------------------------------------------------------
 # Move class
@@ -585,6 +1252,10 @@ class CastleRights():
 
 
 class Move:
+    # slots so the millions of moves made in a search stay small
+    __slots__ = ("startRow", "startCol", "endRow", "endCol", "pieceMoved", "pieceCaptured",
+                 "isPawnPromotion", "isEnpassantMove", "isCastleMove", "promotionPiece", "moveID", "code")
+
     # maps keys to vales
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4,
                    "5": 3, "6": 2, "7": 1, "8": 0}
@@ -594,7 +1265,8 @@ class Move:
                    "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
-    def __init__(self, startSq, endSq, board, isPawnPromotion = False, isEnpassantMove=False, isCastleMove=False):
+    def __init__(self, startSq, endSq, board, isPawnPromotion = False, isEnpassantMove=False, isCastleMove=False,
+                 promotionPiece="Q"):
         self.startRow = startSq[0]
         self.startCol = startSq[1]
         self.endRow = endSq[0]
@@ -603,6 +1275,7 @@ class Move:
         self.pieceCaptured = board[self.endRow][self.endCol]  # piece captured can be blank
         
         self.isPawnPromotion = isPawnPromotion
+        self.promotionPiece = promotionPiece
         
         self.isEnpassantMove = isEnpassantMove
         if self.isEnpassantMove:
@@ -611,10 +1284,50 @@ class Move:
         self.isCastleMove = isCastleMove
         
         self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+        # worked out once here, the search compares codes all the time
+        if isPawnPromotion:
+            moveType = MOVE_PROMOTION
+        elif isEnpassantMove:
+            moveType = MOVE_ENPASSANT
+        elif isCastleMove:
+            moveType = MOVE_CASTLE
+        else:
+            moveType = MOVE_NORMAL
+        self.code = encodeMove(self.startRow * 8 + self.startCol, self.endRow * 8 + self.endCol, moveType, promotionPiece)
+
+    @staticmethod
+    def fromCode(code, board):
+        # build the Move for a 16 bit code in the position given by board
+        startRow, startCol = SQUARES[code & 63]
+        pieceMoved = board[startRow][startCol]
+        if code & 0x3000 == MOVE_ENPASSANT:
+            pieceCaptured = "wP" if pieceMoved == "bP" else "bP"
+        else:
+            endRow, endCol = SQUARES[code >> 6 & 63]
+            pieceCaptured = board[endRow][endCol]
+        return Move.fromPieces(code, pieceMoved, pieceCaptured)
+
+    @staticmethod
+    def fromPieces(code, pieceMoved, pieceCaptured):
+        # build the Move for a 16 bit code when the pieces are already known, skips __init__
+        move = Move.__new__(Move)
+        move.startRow, move.startCol = startRow, startCol = SQUARES[code & 63]
+        move.endRow, move.endCol = endRow, endCol = SQUARES[code >> 6 & 63]
+        move.pieceMoved = pieceMoved
+        move.pieceCaptured = pieceCaptured
+        moveType = code & 0x3000
+        move.isPawnPromotion = moveType == MOVE_PROMOTION
+        move.promotionPiece = PROMOTION_PIECES[code >> 14]
+        move.isEnpassantMove = moveType == MOVE_ENPASSANT
+        move.isCastleMove = moveType == MOVE_CASTLE
+        move.moveID = startRow * 1000 + startCol * 100 + endRow * 10 + endCol
+        move.code = code
+        return move
 
     def __eq__(self, other):
         if isinstance(other, Move):
-            return self.moveID == other.moveID
+            # the four promotions of a pawn share a moveID, non promotions all have the default piece
+            return self.moveID == other.moveID and self.promotionPiece == other.promotionPiece
         return False
 
     def getChessNotation(self):
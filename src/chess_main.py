@@ -23,6 +23,7 @@ __version__ = "0.1"
 # Imports
 # -----------------------------------------------------------------------------
 
+import os
 import pygame as p
 import Chess.src.chess_engine as ce
 import Chess.src.chess_computer as cc
@@ -36,6 +37,15 @@ DIMENSION = 8  # dimension of chess board are 8 by 8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 15  # for animation
 IMAGES = {}
+BACKEND = "bitboard"  # "list" or "bitboard" game state
+AI_MOVE_TIME = 1  # seconds the computer thinks for each move
+AI_WORKERS = 1  # processes the computer's search is split over, more than 1 needs that many cores
+PONDER = True  # the computer searches the reply it expects while the human thinks
+BOOK_PATH = "../book.bin"  # opening book made with chess_book, the computer searches every move without it
+TABLEBASE_DIR = "../tablebases"  # endgame tables made with chess_tablebase
+NNUE_PATH = "../nnue.npz"  # network weights made with chess_nnue, the hand written score is used without them
+PROMOTION_PIECE = "Q"  # what a pawn the human moves to the back row becomes
+SEARCH_STATS_PATH = None  # file the computer's search stats are added to as JSON lines, None to not log them
 
 # %% --------------------------------------------------------------------------
 # Load images to create a global dictionary of images, only called once
@@ -59,7 +69,19 @@ def main():
     # screen.fill(p.Color("white"))
     loadImage()
     clock = p.time.Clock()
-    gs = ce.GameState()
+    gs = ce.createGameState(BACKEND)
+    if os.path.exists(BOOK_PATH):
+        from Chess.src.chess_book import OpeningBook  # imported here so chess_book can run as a script
+        cc.defaultSearcher.book = OpeningBook(BOOK_PATH)
+    if os.path.isdir(TABLEBASE_DIR):
+        from Chess.src.chess_tablebase import Tablebases
+        cc.defaultSearcher.tablebases = Tablebases(TABLEBASE_DIR)
+    if os.path.exists(NNUE_PATH):
+        from Chess.src.chess_nnue import Network
+        cc.defaultSearcher.evaluator = Network.load(NNUE_PATH)
+    if SEARCH_STATS_PATH is not None:
+        cc.defaultSearcher.statsCallback = cc.jsonLinesWriter(open(SEARCH_STATS_PATH, "a"))
+    ponderer = cc.Ponderer(cc.defaultSearcher)
 
     validMoves = gs.getValidMoves()  # get a list of possible moves
     moveMade = False  # track when a move is made
@@ -79,6 +101,8 @@ def main():
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
+                ponderer.stop()
+                cc.shutdownProcessPool()
 
             # tracking mouse
             elif e.type == p.MOUSEBUTTONDOWN:
@@ -93,28 +117,31 @@ def main():
                         sqSelected = (row, col)
                         playerClicks.append(sqSelected)  # append first and second click
                     if len(playerClicks) == 2:  # selected piece and move
-                        move = ce.Move(playerClicks[0], playerClicks[1], gs.board)
-                        print(move.getChessNotation())
+                        move = ce.Move(playerClicks[0], playerClicks[1], gs.board, promotionPiece=PROMOTION_PIECE)
                         for i in range(len(validMoves)):
-                            if move == validMoves[i]:
+                            if move == validMoves[i]:  # only matches the promotion to PROMOTION_PIECE
                                 gs.makeMove(validMoves[i])
                                 moveMade = True
                                 animate = True
                                 sqSelected = ()  # deselect
                                 playerClicks = []  # clear
+                                break
                         if not moveMade:
                             playerClicks = [sqSelected]
 
             # tracking keyboard
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z:    # Z undos move
+                    ponderer.stop()
                     gs.undoMove()
                     moveMade = True
                     animate = False
                     gameOver = False
             
                 if e.key == p.K_r:    # R resets board
-                    gs = ce.GameState()
+                    ponderer.stop()
+                    gs = ce.createGameState(BACKEND)
+                    cc.defaultSearcher.newGame()  # old positions won't come up again
                     validMoves = gs.getValidMoves()  # get a list of possible moves
                     moveMade = False  # track when a move is made
                     animate = False # flag variable for when variable should be annimated
@@ -125,13 +152,17 @@ def main():
 
         ## AI move finder
         if not gameOver and not humanTurn:
-            AIMove = cc.findBestMove(gs, validMoves)
+            AIMove = ponderer.finish(gs, validMoves, AI_MOVE_TIME)  # the search may already be done
+            if AIMove is None:
+                AIMove = cc.findBestMove(gs, validMoves, timeLimit=AI_MOVE_TIME, workers=AI_WORKERS)
             if AIMove is None:
                 AIMove = cc.findRandomMove(validMoves)
                 
             gs.makeMove(AIMove)
             moveMade = True
             animate = True        
+            if PONDER and ((gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)):
+                ponderer.start(gs)
         
         if moveMade:
             if animate:
@@ -0,0 +1,341 @@
+"""
+chess_match.py
+
+Engine against engine matches to tell whether a change to the search or evaluation
+made the computer stronger. Two configurations of Searcher play each other from the
+same openings with the colours swapped, games are spread over worker processes and
+adjudicated (repetition, 50 moves, insufficient material, too long, one side far
+ahead, tablebases), and the score is shown as it comes in as an Elo difference with
+a 95% interval and a sequential probability ratio test (SPRT) that can stop the match
+once the result is clear.
+
+Engine config : comma separated Searcher settings, e.g. "nullMovePruning=False,depth=4",
+                plus book=<file>, tablebases=<folder> and nnue=<weights>
+
+Usage : python -m Chess.src.chess_match --engine1 "" --engine2 "lateMoveReductions=False" --games 200 --nodes 5000
+        options --workers N, --openings file.fen|file.pgn, --sprt 0 5, --output games.jsonl
+"""
+
+__date__ = "2026-10-18"
+__author__ = "WilliamGasson"
+__version__ = "0.1"
+
+
+# %% --------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import argparse
+import ast
+import json
+import math
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import Chess.src.chess_computer as cc
+import Chess.src.chess_engine as ce
+import Chess.src.chess_pgn as cp
+from Chess.src.chess_perft import moveNotation
+
+# %% --------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+MATCH_BACKEND = "bitboard"
+OPENING_PLIES = 6  # random moves played from the start position when no openings file is given
+MAX_PLIES = 300  # a game this long is a draw
+RESIGN_SCORE = 10  # pawns, both engines agreeing one side is this far ahead ...
+RESIGN_MOVES = 4  # ... for this many moves in a row ends the game
+IN_FLIGHT_PER_WORKER = 2
+SPRT_ALPHA = SPRT_BETA = 0.05  # chances of accepting the wrong hypothesis
+
+# %% --------------------------------------------------------------------------
+# Engines and openings
+# -----------------------------------------------------------------------------
+
+
+def parseConfig(text):
+    # "key=value,key=value" to a dict, values are python literals where they can be
+    config = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        key, value = item.split("=", 1)
+        try:
+            config[key.strip()] = ast.literal_eval(value.strip())
+        except (ValueError, SyntaxError):
+            config[key.strip()] = value.strip()
+    return config
+
+
+def makeSearcher(config):
+    settings = dict(config)
+    book, tablebases, nnue = settings.pop("book", None), settings.pop("tablebases", None), settings.pop("nnue", None)
+    searcher = cc.Searcher(**settings)
+    if book is not None:
+        from Chess.src.chess_book import OpeningBook
+        searcher.book = OpeningBook(book)
+    if tablebases is not None:
+        from Chess.src.chess_tablebase import Tablebases
+        searcher.tablebases = Tablebases(tablebases)
+    if nnue is not None:
+        from Chess.src.chess_nnue import Network
+        searcher.evaluator = Network.load(nnue)
+    return searcher
+
+
+def randomOpening(rng, plies=OPENING_PLIES):
+    # FEN after random legal moves from the start, tried again if the game ends on the way
+    while True:
+        gs = ce.createGameState(MATCH_BACKEND)
+        for _ in range(plies):
+            moves = gs.getValidMoves()
+            if not moves:
+                break
+            gs.makeMove(rng.choice(moves))
+        else:
+            if gs.getValidMoves():
+                return gs.getFEN()
+
+
+def readOpenings(path, plies=OPENING_PLIES):
+    # FENs, one per line, or the position after the first moves of each game of a PGN file
+    if not path.lower().endswith(".pgn"):
+        with open(path) as file:
+            return [line.strip() for line in file if line.strip()]
+    openings = []
+    gs = ce.createGameState(MATCH_BACKEND)
+    for tags, moves, result in cp.readGames(path):
+        gs.loadFEN(tags.get("FEN", ce.STARTING_FEN))
+        try:
+            for san in moves[:plies]:
+                gs.makeMove(cp.parseSAN(gs, san))
+        except ValueError:
+            continue
+        openings.append(gs.getFEN())
+    return openings
+
+# %% --------------------------------------------------------------------------
+# Playing a game
+# -----------------------------------------------------------------------------
+
+
+def insufficientMaterial(gs):
+    # no pawns and at most a bishop or knight each
+    return all(gs.material[colour] == gs.nonPawnMaterial[colour] <= ce.MATERIAL_VALUES["B"] for colour in "wb")
+
+
+def playGame(fen, white, black, timeLimit=None, maxNodes=None, maxDepth=None, tablebases=None):
+    # plays white against black (Searchers) from fen, returns (result for white 1 / 0.5 / 0, reason, moves)
+    for searcher in (white, black):
+        searcher.newGame()
+    gs = ce.createGameState(MATCH_BACKEND)
+    gs.loadFEN(fen)
+    seen = {gs.zobristKey: 1}
+    moves = []
+    resignCount = 0  # moves in a row both engines have had one side winning by RESIGN_SCORE
+    lastScore = None
+    while True:
+        validMoves = gs.getValidMoves()
+        turnMultiplier = 1 if gs.whiteToMove else -1
+        if not validMoves:
+            if gs.checkmate:
+                return (0 if gs.whiteToMove else 1), "checkmate", moves
+            return 0.5, "stalemate", moves
+        if gs.halfmoveClock >= 100:
+            return 0.5, "50 moves", moves
+        if insufficientMaterial(gs):
+            return 0.5, "insufficient material", moves
+        if len(moves) >= MAX_PLIES:
+            return 0.5, "too long", moves
+        if tablebases is not None:
+            value = tablebases.probe(gs)
+            if value is not None:
+                if value == 0:
+                    return 0.5, "tablebase", moves
+                return (1 if (value > 0) == gs.whiteToMove else 0), "tablebase", moves
+
+        searcher = white if gs.whiteToMove else black
+        move = searcher.findBestMove(gs, validMoves, timeLimit, maxNodes, maxDepth)
+        score = turnMultiplier * searcher.score  # white's point of view
+        if lastScore is not None and abs(score) >= RESIGN_SCORE and abs(lastScore) >= RESIGN_SCORE and \
+                (score > 0) == (lastScore > 0):
+            resignCount += 1
+            if resignCount >= RESIGN_MOVES:
+                return (1 if score > 0 else 0), "adjudicated", moves
+        else:
+            resignCount = 0
+        lastScore = score
+        gs.makeMove(move)
+        moves.append(moveNotation(move))
+        seen[gs.zobristKey] = seen.get(gs.zobristKey, 0) + 1
+        if seen[gs.zobristKey] >= 3:
+            return 0.5, "repetition", moves
+
+# %% --------------------------------------------------------------------------
+# Match over a process pool
+# -----------------------------------------------------------------------------
+
+workerEngines = {}  # in a worker process, Searchers by config so their tables are made once
+workerTablebases = {}
+
+
+def playGameTask(args):
+    # runs in a worker process, returns the game as a dict with the result for engine 1
+    number, fen, configs, engine1White, timeLimit, maxNodes, maxDepth, tablebaseDir = args
+    searchers = []
+    for i, config in enumerate(configs):
+        key = (i, json.dumps(config, sort_keys=True))  # one each even if the configs are the same
+        if key not in workerEngines:
+            workerEngines[key] = makeSearcher(config)
+        searchers.append(workerEngines[key])
+    tablebases = None
+    if tablebaseDir is not None:
+        if tablebaseDir not in workerTablebases:
+            from Chess.src.chess_tablebase import Tablebases
+            workerTablebases[tablebaseDir] = Tablebases(tablebaseDir)
+        tablebases = workerTablebases[tablebaseDir]
+    white, black = searchers if engine1White else searchers[::-1]
+    start = time.perf_counter()
+    result, reason, moves = playGame(fen, white, black, timeLimit, maxNodes, maxDepth, tablebases)
+    return {"game": number, "opening": fen, "engine1": "white" if engine1White else "black",
+            "result": {1: "1-0", 0.5: "1/2-1/2", 0: "0-1"}[result], "score": result if engine1White else 1 - result,
+            "reason": reason, "plies": len(moves), "moves": moves, "seconds": round(time.perf_counter() - start, 2)}
+
+
+def eloFromScore(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def scoreFromElo(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def matchStats(wins, draws, losses, elo0=0, elo1=5):
+    # Elo difference for engine 1 with a 95% interval and the SPRT log likelihood ratio with its bounds,
+    # from the mean and variance of the game scores (normal approximation to the trinomial)
+    games = wins + draws + losses
+    stats = {"games": games, "wins": wins, "draws": draws, "losses": losses}
+    if games == 0:
+        return stats
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    stats["score"] = score
+    stats["elo"] = eloFromScore(score)
+    stats["eloLow"], stats["eloHigh"] = eloFromScore(score - margin), eloFromScore(score + margin)
+    # half a game of each result is added for the test so a run of the same result still has a variance
+    pseudoScore = (wins + draws / 2 + 0.75) / (games + 1.5)
+    pseudoVariance = ((wins + 0.5) * (1 - pseudoScore) ** 2 + (draws + 0.5) * (0.5 - pseudoScore) ** 2 +
+                      (losses + 0.5) * pseudoScore ** 2) / (games + 1.5)
+    score0, score1 = scoreFromElo(elo0), scoreFromElo(elo1)
+    stats["llr"] = (score1 - score0) * (2 * pseudoScore - score0 - score1) * games / (2 * pseudoVariance)
+    stats["llrLow"], stats["llrHigh"] = math.log(SPRT_BETA / (1 - SPRT_ALPHA)), math.log((1 - SPRT_BETA) / SPRT_ALPHA)
+    return stats
+
+
+def runMatch(config1, config2, games, workers=1, timeLimit=None, maxNodes=None, maxDepth=None, openings=None,
+             seed=0, sprt=None, tablebaseDir=None, onGame=None, openingPlies=OPENING_PLIES):
+    # plays up to games games in pairs (same opening, colours swapped). sprt is (elo0, elo1) to stop once
+    # either is accepted. onGame(game, stats) is called as each game finishes. openingPlies random moves
+    # start each pair when no openings are given. Returns the final stats
+    rng = random.Random(seed)
+
+    def tasks():
+        for number in range(games):
+            if number % 2 == 0:
+                fen = openings[number // 2 % len(openings)] if openings else randomOpening(rng, openingPlies)
+            yield (number + 1, fen, (config1, config2), number % 2 == 0, timeLimit, maxNodes, maxDepth, tablebaseDir)
+
+    elo0, elo1 = sprt if sprt is not None else (0, 5)
+    counts = {1: 0, 0.5: 0, 0: 0}
+    start = time.perf_counter()
+    stats = matchStats(0, 0, 0, elo0, elo1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        queue = tasks()
+        for task in queue:
+            pending.add(pool.submit(playGameTask, task))
+            if len(pending) >= workers * IN_FLIGHT_PER_WORKER:
+                break
+        stopped = False
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                game = future.result()
+                counts[game["score"]] += 1
+                stats = matchStats(counts[1], counts[0.5], counts[0], elo0, elo1)
+                elapsed = time.perf_counter() - start
+                stats["gamesPerSecond"] = stats["games"] / elapsed if elapsed else 0
+                if sprt is not None and not (stats["llrLow"] < stats["llr"] < stats["llrHigh"]):
+                    stats["sprt"] = "H1" if stats["llr"] >= stats["llrHigh"] else "H0"
+                    stopped = True
+                if onGame is not None:
+                    onGame(game, stats)
+            if stopped:
+                for future in pending:
+                    future.cancel()
+                break
+            for task in queue:  # top the window back up
+                pending.add(pool.submit(playGameTask, task))
+                if len(pending) >= workers * IN_FLIGHT_PER_WORKER:
+                    break
+    return stats
+
+# %% --------------------------------------------------------------------------
+# Command line
+# -----------------------------------------------------------------------------
+
+
+def formatStats(stats):
+    text = "games {games}: +{wins} ={draws} -{losses}".format(**stats)
+    if stats["games"]:
+        text += ", Elo {:+.1f} [{:+.1f}, {:+.1f}]".format(stats["elo"], stats["eloLow"], stats["eloHigh"])
+        text += ", LLR {:.2f} ({:.2f}, {:.2f})".format(stats["llr"], stats["llrLow"], stats["llrHigh"])
+        text += ", {:.2f} games/s".format(stats.get("gamesPerSecond", 0))
+    if "sprt" in stats:
+        text += ", SPRT accepts {}".format(stats["sprt"])
+    return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play two engine configurations against each other")
+    parser.add_argument("--engine1", default="", help="settings of the engine being tested")
+    parser.add_argument("--engine2", default="", help="settings of the engine it is compared to")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--nodes", type=int, default=None, help="search budget per move")
+    parser.add_argument("--time", type=float, default=None, help="seconds per move")
+    parser.add_argument("--depth", type=int, default=None)
+    parser.add_argument("--openings", default=None, help="FEN per line or PGN file, random moves if not given")
+    parser.add_argument("--opening-plies", type=int, default=OPENING_PLIES,
+                        help="random moves to start from, or moves kept from each game of a PGN openings file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sprt", type=float, nargs=2, metavar=("ELO0", "ELO1"), default=None,
+                        help="stop when engine 1 is shown to be ELO1 better (H1) or no better than ELO0 (H0)")
+    parser.add_argument("--tablebases", default=None, help="folder of chess_tablebase tables to adjudicate with")
+    parser.add_argument("--output", default=None, help="file to write each game to as JSON lines")
+    args = parser.parse_args(argv)
+    if args.nodes is None and args.time is None and args.depth is None:
+        args.nodes = 5000
+
+    openings = readOpenings(args.openings, args.opening_plies) if args.openings else None
+    out = open(args.output, "w") if args.output else None
+
+    def onGame(game, stats):
+        if out is not None:
+            out.write(json.dumps(game) + "\n")
+            out.flush()
+        print("game {} {} ({}) - {}".format(game["game"], game["result"], game["reason"], formatStats(stats)), flush=True)
+
+    stats = runMatch(parseConfig(args.engine1), parseConfig(args.engine2), args.games, args.workers, args.time,
+                     args.nodes, args.depth, openings, args.seed, args.sprt, args.tablebases, onGame,
+                     args.opening_plies)
+    if out is not None:
+        out.close()
+    print(formatStats(stats))
+
+
+if __name__ == "__main__":
+    main()
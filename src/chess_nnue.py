@@ -0,0 +1,269 @@
+"""
+chess_nnue.py
+
+Small neural network evaluation in the style of NNUE. The inputs are 768 piece-square
+features (12 pieces on 64 squares) seen from both sides, the first layer turns them into
+two hidden vectors (the accumulator) and the output is a score in pawns for the side to
+move. Only a few features change in a move, so the accumulator is kept up to date by
+GameState.makeMove/undoMove adding and taking away rows of the first layer rather than
+multiplying out the whole board at every leaf.
+
+Weights file : numpy .npz with w1 (768 x hidden), b1 (hidden), w2 (2 * hidden) and b2 (1)
+
+Usage : python -m Chess.src.chess_nnue train games.pgn net.npz --hidden 64 --epochs 10
+        python -m Chess.src.chess_nnue evaluate net.npz "<fen>"
+"""
+
+__date__ = "2026-10-18"
+__author__ = "WilliamGasson"
+__version__ = "0.1"
+
+
+# %% --------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import argparse
+
+import numpy as np
+
+import Chess.src.chess_engine as ce
+
+# %% --------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+PIECES = ["wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK"]
+FEATURES = len(PIECES) * 64
+HIDDEN = 64
+STACK_SIZE = 256  # plies of accumulators made before the stack has to grow
+# FEATURE[piece][sq] is the input for white's side of the network, black's side sees the board turned
+# over with the colours swapped so the same weights work for both
+FEATURE = {piece: [i * 64 + sq for sq in range(64)] for i, piece in enumerate(PIECES)}
+MIRROR_FEATURE = {piece: [((i + 6) % 12) * 64 + (sq ^ 56) for sq in range(64)] for i, piece in enumerate(PIECES)}
+
+# %% --------------------------------------------------------------------------
+# Network
+# -----------------------------------------------------------------------------
+
+
+class Network:
+    def __init__(self, w1, b1, w2, b2):
+        self.w1 = np.asarray(w1, dtype=np.float32)
+        self.b1 = np.asarray(b1, dtype=np.float32)
+        self.w2 = np.asarray(w2, dtype=np.float32)
+        self.b2 = float(np.asarray(b2).reshape(-1)[0])
+        self.hidden = self.w1.shape[1]
+        self.path = None  # file the weights came from, so worker processes can load the same network
+        # pairs[f] is the row for feature f from white's side and the row for the same piece from black's,
+        # so a piece going on or off the board is one add to both halves of the accumulator
+        mirror = np.array([MIRROR_FEATURE[piece][sq] for piece in PIECES for sq in range(64)])
+        self.pairs = np.stack([self.w1, self.w1[mirror]], axis=1)
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as weights:
+            network = Network(weights["w1"], weights["b1"], weights["w2"], weights["b2"])
+        network.path = path
+        return network
+
+    @staticmethod
+    def random(hidden=HIDDEN, seed=0):
+        # untrained starting point for train
+        rng = np.random.default_rng(seed)
+        return Network(rng.normal(0, 0.1, (FEATURES, hidden)), np.zeros(hidden),
+                       rng.normal(0, 1 / hidden, 2 * hidden), 0)
+
+    def save(self, path):
+        np.savez(path, w1=self.w1, b1=self.b1, w2=self.w2, b2=np.array([self.b2], dtype=np.float32))
+
+    def newAccumulator(self, board):
+        return Accumulator(self, board)
+
+    def output(self, us, them):
+        # clipped relu on both halves, the side to move's half first
+        return float(np.clip(us, 0, 1) @ self.w2[:self.hidden] + np.clip(them, 0, 1) @ self.w2[self.hidden:]) + self.b2
+
+    def evaluate(self, gs):
+        # score in pawns for the side to move from the accumulator kept on the game state
+        values = gs.accumulator.values[gs.accumulator.ply]
+        return self.output(values[0], values[1]) if gs.whiteToMove else self.output(values[1], values[0])
+
+    def evaluateBoard(self, board, whiteToMove):
+        # the same score worked out from scratch, slow, for checking and one off use
+        values = boardAccumulator(self, board)
+        return self.output(values[0], values[1]) if whiteToMove else self.output(values[1], values[0])
+
+
+def boardAccumulator(network, board):
+    values = np.tile(network.b1, (2, 1))
+    for r in range(8):
+        for c in range(8):
+            piece = board[r][c]
+            if piece != "--":
+                values += network.pairs[FEATURE[piece][r * 8 + c]]
+    return values
+
+# %% --------------------------------------------------------------------------
+# Accumulator - first layer output for each ply, kept up to date move by move
+# -----------------------------------------------------------------------------
+
+
+class Accumulator:
+    def __init__(self, network, board):
+        self.network = network
+        self.values = np.zeros((STACK_SIZE, 2, network.hidden), dtype=np.float32)
+        self.refresh(board)
+
+    def refresh(self, board):
+        # start again from the board, after loadFEN
+        self.ply = 0
+        self.values[0] = boardAccumulator(self.network, board)
+
+    def push(self, move, placed):
+        # called by makeMove once the board is updated, placed is the piece now on the end square
+        if self.ply + 1 == len(self.values):
+            self.values = np.concatenate([self.values, np.zeros_like(self.values)])
+        pairs = self.network.pairs
+        current = self.values[self.ply + 1]
+        np.subtract(self.values[self.ply], pairs[FEATURE[move.pieceMoved][move.startRow * 8 + move.startCol]],
+                    out=current)
+        current += pairs[FEATURE[placed][move.endRow * 8 + move.endCol]]
+        if move.pieceCaptured != "--":
+            capturedRow = move.startRow if move.isEnpassantMove else move.endRow
+            current -= pairs[FEATURE[move.pieceCaptured][capturedRow * 8 + move.endCol]]
+        elif move.isCastleMove:
+            rook = move.pieceMoved[0] + "R"
+            rookFrom, rookTo = (7, 5) if move.endCol == 6 else (0, 3)
+            current -= pairs[FEATURE[rook][move.endRow * 8 + rookFrom]]
+            current += pairs[FEATURE[rook][move.endRow * 8 + rookTo]]
+        self.ply += 1
+
+    def pop(self):
+        # called by undoMove, the ply below is still as it was
+        self.ply -= 1
+
+# %% --------------------------------------------------------------------------
+# Training - fit the network to a target score for positions from games
+# -----------------------------------------------------------------------------
+
+
+def positionFeatures(gs):
+    # active inputs for the side to move's half and the other half
+    white, black = [], []
+    for r in range(8):
+        for c in range(8):
+            piece = gs.board[r][c]
+            if piece != "--":
+                white.append(FEATURE[piece][r * 8 + c])
+                black.append(MIRROR_FEATURE[piece][r * 8 + c])
+    return (white, black) if gs.whiteToMove else (black, white)
+
+
+def collectPositions(pgnPaths, evaluate, maxPositions=None):
+    # (features, target) for every position in the games, target is evaluate(gs) for the side to move
+    import Chess.src.chess_pgn as cp  # only training reads games
+    positions = []
+    gs = ce.GameState()
+    for path in pgnPaths:
+        for tags, moves, result in cp.readGames(path):
+            gs.loadFEN(tags.get("FEN", ce.STARTING_FEN))
+            for san in moves:
+                try:
+                    gs.makeMove(cp.parseSAN(gs, san))
+                except ValueError:
+                    break
+                positions.append((positionFeatures(gs), evaluate(gs)))
+                if maxPositions is not None and len(positions) >= maxPositions:
+                    return positions
+    return positions
+
+
+def inputMatrix(features):
+    matrix = np.zeros((len(features), FEATURES), dtype=np.float32)
+    for i, active in enumerate(features):
+        matrix[i, active] = 1
+    return matrix
+
+
+def train(network, positions, epochs=10, batchSize=256, learningRate=0.003, log=print):
+    # minibatch Adam on the squared error, positions is [((us features, them features), target)].
+    # Returns the trained copy of network
+    params = [network.w1.copy(), network.b1.copy(), network.w2.copy(), np.array([network.b2], dtype=np.float32)]
+    moments = [np.zeros_like(param) for param in params]
+    squares = [np.zeros_like(param) for param in params]
+    beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+    hidden = network.hidden
+    rng = np.random.default_rng(0)
+    step = 0
+    for epoch in range(epochs):
+        order = rng.permutation(len(positions))
+        totalLoss = 0
+        for start in range(0, len(order), batchSize):
+            batch = [positions[i] for i in order[start:start + batchSize]]
+            xUs = inputMatrix([features[0] for features, _ in batch])
+            xThem = inputMatrix([features[1] for features, _ in batch])
+            target = np.array([score for _, score in batch], dtype=np.float32)
+            w1, b1, w2, b2 = params
+            preUs, preThem = xUs @ w1 + b1, xThem @ w1 + b1
+            hUs, hThem = np.clip(preUs, 0, 1), np.clip(preThem, 0, 1)
+            error = hUs @ w2[:hidden] + hThem @ w2[hidden:] + b2[0] - target
+            totalLoss += float(error @ error)
+
+            # gradients of the mean squared error
+            dOut = 2 * error / len(batch)
+            dW2 = np.concatenate([hUs.T @ dOut, hThem.T @ dOut])
+            dB2 = np.array([dOut.sum()], dtype=np.float32)
+            dUs = np.outer(dOut, w2[:hidden]) * ((preUs > 0) & (preUs < 1))
+            dThem = np.outer(dOut, w2[hidden:]) * ((preThem > 0) & (preThem < 1))
+            dW1 = xUs.T @ dUs + xThem.T @ dThem
+            dB1 = dUs.sum(axis=0) + dThem.sum(axis=0)
+
+            step += 1
+            for param, grad, moment, square in zip(params, (dW1, dB1, dW2, dB2), moments, squares):
+                moment *= beta1
+                moment += (1 - beta1) * grad
+                square *= beta2
+                square += (1 - beta2) * grad * grad
+                param -= learningRate * (moment / (1 - beta1 ** step)) / (np.sqrt(square / (1 - beta2 ** step)) + epsilon)
+        log("epoch {}: mean squared error {:.4f}".format(epoch + 1, totalLoss / len(positions)))
+    return Network(params[0], params[1], params[2], params[3])
+
+# %% --------------------------------------------------------------------------
+# Command line
+# -----------------------------------------------------------------------------
+
+
+def main(argv=None):
+    import Chess.src.chess_computer as cc  # the hand written score the network learns from
+
+    parser = argparse.ArgumentParser(description="Train and try the neural network evaluation")
+    commands = parser.add_subparsers(dest="command", required=True)
+    trainParser = commands.add_parser("train", help="fit a network to the hand written score of positions from games")
+    trainParser.add_argument("pgn", nargs="+")
+    trainParser.add_argument("weights")
+    trainParser.add_argument("--hidden", type=int, default=HIDDEN)
+    trainParser.add_argument("--epochs", type=int, default=10)
+    trainParser.add_argument("--positions", type=int, default=None, help="most positions to use")
+    trainParser.add_argument("--start", default=None, help="weights to carry on training from")
+    evaluateParser = commands.add_parser("evaluate", help="score a position")
+    evaluateParser.add_argument("weights")
+    evaluateParser.add_argument("fen", nargs="?", default="startpos")
+    args = parser.parse_args(argv)
+
+    if args.command == "train":
+        positions = collectPositions(args.pgn, lambda gs: (1 if gs.whiteToMove else -1) * cc.scorePosition(gs),
+                                     args.positions)
+        print("{} positions".format(len(positions)))
+        network = Network.load(args.start) if args.start else Network.random(args.hidden)
+        train(network, positions, args.epochs).save(args.weights)
+    else:
+        network = Network.load(args.weights)
+        gs = ce.GameState()
+        gs.loadFEN(ce.STARTING_FEN if args.fen == "startpos" else args.fen)
+        print("network {:.2f}, hand written {:.2f} (pawns for the side to move)".format(
+            network.evaluateBoard(gs.board, gs.whiteToMove), (1 if gs.whiteToMove else -1) * cc.scorePosition(gs)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+chess_perft.py
+
+Counts every leaf of the move tree to a fixed depth. The totals for well known
+positions are published so this checks getValidMoves (castling, enpassant, pins,
+promotion) and times the move generator.
+
+Usage : python -m Chess.src.chess_perft perft "<fen>" <depth>
+        options --backend list|bitboard, --hash to reuse subtree counts, --workers N to split the root moves
+"""
+
+__date__ = "2026-10-18"
+__author__ = "WilliamGasson"
+__version__ = "0.1"
+
+
+# %% --------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import Chess.src.chess_engine as ce
+
+# %% --------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+MAX_TABLE_ENTRIES = 2_000_000  # subtree counts kept before the table is cleared
+
+# %% --------------------------------------------------------------------------
+# Counting
+# -----------------------------------------------------------------------------
+
+
+def perft(gs, depth, table=None):
+    # table maps (zobrist key, depth) to a count so transposed subtrees are only walked once
+    if depth == 0:
+        return 1
+    if depth == 1:
+        return len(gs.getValidMoveCodes())  # no need to make the last moves to count them
+    if table is not None:
+        key = (gs.zobristKey, depth)
+        if key in table:
+            return table[key]
+
+    nodes = 0
+    for code in gs.getValidMoveCodes():
+        gs.makeMoveCode(code)
+        nodes += perft(gs, depth - 1, table)
+        gs.undoMove()
+
+    if table is not None:
+        if len(table) >= MAX_TABLE_ENTRIES:
+            table.clear()
+        table[key] = nodes
+    return nodes
+
+
+def perftRootMove(args):
+    # runs in a worker process, so the position is sent as a FEN and the move as its code
+    fen, code, depth, backend, useHash = args
+    gs = ce.createGameState(backend)
+    gs.moveCacheSize = 0  # time the generator, not the legal move cache
+    gs.loadFEN(fen)
+    gs.makeMoveCode(code)
+    return perft(gs, depth, {} if useHash else None)
+
+
+def moveNotation(move):
+    return move.getChessNotation() + (move.promotionPiece.lower() if move.isPawnPromotion else "")
+
+
+def divide(gs, depth, useHash=False, workers=1, backend="bitboard"):
+    # node count below each root move, the first thing to compare when a total is wrong
+    if depth < 1:
+        raise ValueError("divide needs a depth of at least 1, got {}".format(depth))
+    moves = gs.getValidMoves()
+    if depth == 1:
+        return [(moveNotation(move), 1) for move in moves]
+
+    if workers > 1:
+        fen = gs.getFEN()
+        tasks = [(fen, move.code, depth - 1, backend, useHash) for move in moves]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            counts = list(executor.map(perftRootMove, tasks))
+    else:
+        table = {} if useHash else None
+        counts = []
+        for move in moves:
+            gs.makeMove(move)
+            counts.append(perft(gs, depth - 1, table))
+            gs.undoMove()
+    return [(moveNotation(move), count) for move, count in zip(moves, counts)]
+
+# %% --------------------------------------------------------------------------
+# Command line
+# -----------------------------------------------------------------------------
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count move tree leaves to test and time the move generator")
+    commands = parser.add_subparsers(dest="command", required=True)
+    perftParser = commands.add_parser("perft", help="count leaf nodes with divide output")
+    perftParser.add_argument("fen", help='position as a FEN string or "startpos"')
+    perftParser.add_argument("depth", type=int)
+    perftParser.add_argument("--backend", choices=("list", "bitboard"), default="bitboard")
+    perftParser.add_argument("--hash", action="store_true", help="reuse counts of transposed subtrees")
+    perftParser.add_argument("--workers", type=int, default=1, help="processes to split the root moves over")
+    args = parser.parse_args(argv)
+    if args.depth < 1:
+        parser.error("depth must be at least 1")
+
+    gs = ce.createGameState(args.backend)
+    gs.moveCacheSize = 0  # time the generator, not the legal move cache
+    gs.loadFEN(ce.STARTING_FEN if args.fen == "startpos" else args.fen)
+
+    start = time.perf_counter()
+    counts = divide(gs, args.depth, args.hash, args.workers, args.backend)
+    elapsed = time.perf_counter() - start
+
+    for notation, count in sorted(counts):
+        print("{}: {}".format(notation, count))
+    nodes = sum(count for _, count in counts)
+    print()
+    print("Nodes: {}".format(nodes))
+    print("Time: {:.3f}s".format(elapsed))
+    print("Nodes/second: {:.0f}".format(nodes / elapsed if elapsed > 0 else 0))
+
+
+if __name__ == "__main__":
+    main()
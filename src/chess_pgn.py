@@ -0,0 +1,130 @@
+"""
+chess_pgn.py
+
+Reads games in PGN (portable game notation) and turns standard algebraic notation
+(SAN, e.g. Nf3, exd5, O-O, e8=Q+) or coordinate notation (e2e4, e7e8q) into Move
+objects for a GameState.
+"""
+
+__date__ = "2026-10-18"
+__author__ = "WilliamGasson"
+__version__ = "0.1"
+
+
+# %% --------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import re
+
+import Chess.src.chess_engine as ce
+
+# %% --------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+TAG_PATTERN = re.compile(r'\[(\w+)\s+"(.*)"\]')
+# comments, variations and numeric annotations are skipped, variations can be nested so they're removed in a loop
+COMMENT_PATTERN = re.compile(r"\{[^}]*\}|;[^\n]*")
+VARIATION_PATTERN = re.compile(r"\([^()]*\)")
+MOVE_NUMBER_PATTERN = re.compile(r"\d+\.+")
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+COORDINATE_PATTERN = re.compile(r"^([a-h][1-8])([a-h][1-8])([qrbn])?$")  # e2e4, e7e8q, as Move.getChessNotation
+
+# %% --------------------------------------------------------------------------
+# Reading games
+# -----------------------------------------------------------------------------
+
+
+def readGames(path):
+    # yields (tags, SAN moves, result) for each game in the file
+    with open(path, encoding="utf-8", errors="replace") as file:
+        tags = {}
+        moveText = []
+        for line in file:
+            line = line.strip()
+            match = TAG_PATTERN.match(line)
+            if match:
+                if moveText:  # a tag after move text starts the next game
+                    yield parseGame(tags, " ".join(moveText))
+                    tags, moveText = {}, []
+                tags[match.group(1)] = match.group(2)
+            elif line and not line.startswith("%"):
+                moveText.append(line)
+        if tags or moveText:
+            yield parseGame(tags, " ".join(moveText))
+
+
+def parseGame(tags, moveText):
+    moveText = COMMENT_PATTERN.sub(" ", moveText)
+    while True:
+        stripped = VARIATION_PATTERN.sub(" ", moveText)
+        if stripped == moveText:
+            break
+        moveText = stripped
+    moveText = MOVE_NUMBER_PATTERN.sub(" ", moveText)
+    moves = []
+    result = tags.get("Result", "*")
+    for token in moveText.split():
+        if token in RESULTS:
+            result = token
+        elif not token.startswith("$"):
+            moves.append(token)
+    return tags, moves, result
+
+# %% --------------------------------------------------------------------------
+# SAN to Move
+# -----------------------------------------------------------------------------
+
+
+def parseSAN(gs, san, validMoves=None):
+    # the legal move in gs written as san, raises ValueError if there isn't exactly one
+    if validMoves is None:
+        validMoves = gs.getValidMoves()
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        endCol = 6 if len(text) == 3 else 2
+        for move in validMoves:
+            if move.isCastleMove and move.endCol == endCol:
+                return move
+        raise ValueError("illegal castle {}".format(san))
+
+    match = SAN_PATTERN.match(text)
+    if match is None:
+        raise ValueError("can't read move {}".format(san))
+    piece, fromFile, fromRank, target, promotion = match.groups()
+    piece = piece or "P"
+    endRow = ce.Move.ranksToRows[target[1]]
+    endCol = ce.Move.filesToCols[target[0]]
+    candidates = [move for move in validMoves
+                  if move.pieceMoved[1] == piece and move.endRow == endRow and move.endCol == endCol and
+                  not move.isCastleMove and
+                  (not move.isPawnPromotion or move.promotionPiece == (promotion or "Q")) and
+                  (fromFile is None or move.startCol == ce.Move.filesToCols[fromFile]) and
+                  (fromRank is None or move.startRow == ce.Move.ranksToRows[fromRank])]
+    if len(candidates) != 1:
+        raise ValueError("{} matches {} legal moves".format(san, len(candidates)))
+    return candidates[0]
+
+
+def parseCoordinate(gs, text, validMoves=None):
+    # the legal move in gs written as start and end square (e2e4, e7e8q), raises ValueError if it isn't legal
+    match = COORDINATE_PATTERN.match(text)
+    if match is None:
+        raise ValueError("can't read move {}".format(text))
+    if validMoves is None:
+        validMoves = gs.getValidMoves()
+    start, end, promotion = match.groups()
+    for move in validMoves:
+        if move.getChessNotation() == start + end and \
+                (not move.isPawnPromotion or move.promotionPiece == (promotion or "q").upper()):
+            return move
+    raise ValueError("illegal move {}".format(text))
+
+
+def parseMove(gs, text, validMoves=None):
+    # coordinate notation or SAN
+    if COORDINATE_PATTERN.match(text):
+        return parseCoordinate(gs, text, validMoves)
+    return parseSAN(gs, text, validMoves)
@@ -0,0 +1,403 @@
+"""
+chess_tablebase.py
+
+Endgame tablebases for 3 and 4 piece endings (KQvK, KRvK, KPvK, KQvKR...) made by
+retrograde analysis: every position of the ending is set up, checkmates are found
+and results are worked backwards one ply at a time until nothing changes. What is
+left is a draw. Tables are stored one signed byte per position and memory mapped,
+so a probe is a board scan and one read.
+
+Value stored : win in n plies is n, loss in n plies is -(n + 1) (so checkmated is -1),
+               draw and impossible positions are 0. Always for the side to move
+Index : white king square (folded by symmetry) then the square of every other piece,
+        times 2 plus 1 if black is to move. Castling and enpassant aren't in the tables
+
+Usage : python -m Chess.src.chess_tablebase generate KQvK KRvK KPvK --dir tablebases
+        python -m Chess.src.chess_tablebase probe "<fen>" --dir tablebases
+"""
+
+__date__ = "2026-10-18"
+__author__ = "WilliamGasson"
+__version__ = "0.1"
+
+
+# %% --------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import argparse
+import itertools
+import mmap
+import os
+import time
+from array import array
+
+import Chess.src.chess_engine as ce
+
+# %% --------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+TABLE_HEADER = b"CHESSTB1"
+MAX_PIECES = 4
+PIECE_ORDER = "KQRBNP"  # order of pieces in a signature like KRvKP
+# squares the white king is folded onto. Without pawns the board can be mirrored and turned so
+# the king is always in the a1-d1-d4 triangle, with pawns it can only be mirrored left to right
+TRIANGLE = [sq for sq in range(64) if (sq & 7) <= 3 and (sq >> 3) >= 4 and (sq & 7) >= 7 - (sq >> 3)]
+HALF_BOARD = [sq for sq in range(64) if (sq & 7) <= 3]
+KING_INDEX = {False: {sq: i for i, sq in enumerate(TRIANGLE)}, True: {sq: i for i, sq in enumerate(HALF_BOARD)}}
+KING_SQUARES = {False: TRIANGLE, True: HALF_BOARD}
+
+# %% --------------------------------------------------------------------------
+# Signatures, symmetry and indexing
+# -----------------------------------------------------------------------------
+
+
+def signatureOf(pieces):
+    # pieces is a list of (piece, square) like ("wK", 60), gives e.g. "KQvK"
+    white = sorted((piece[1] for piece, _ in pieces if piece[0] == "w"), key=PIECE_ORDER.index)
+    black = sorted((piece[1] for piece, _ in pieces if piece[0] == "b"), key=PIECE_ORDER.index)
+    return "".join(white) + "v" + "".join(black)
+
+
+def tablePieces(signature):
+    # board pieces in table order: both kings then the other white then black pieces
+    white, black = signature.split("v")
+    return ["wK", "bK"] + ["w" + piece for piece in white[1:]] + ["b" + piece for piece in black[1:]]
+
+
+def transformSquare(sq, transform):
+    r, c = sq >> 3, sq & 7
+    if transform & 1:
+        c = 7 - c
+    if transform & 2:
+        r = 7 - r
+    if transform & 4:
+        r, c = 7 - c, 7 - r
+    return r * 8 + c
+
+
+def canonicalTransform(kingSq, hasPawns):
+    r, c = kingSq >> 3, kingSq & 7
+    transform = 0
+    if c > 3:
+        transform |= 1
+        c = 7 - c
+    if not hasPawns:
+        if r < 4:
+            transform |= 2
+            r = 7 - r
+        if c < 7 - r:
+            transform |= 4
+    return transform
+
+
+def positionIndex(squares, hasPawns):
+    # squares in table order, white king first
+    transform = canonicalTransform(squares[0], hasPawns)
+    index = KING_INDEX[hasPawns][transformSquare(squares[0], transform)]
+    for sq in squares[1:]:
+        index = index * 64 + transformSquare(sq, transform)
+    return index
+
+
+def orderSquares(pieces, signature):
+    # squares of the pieces in the order of the table, None if the pieces don't fit it
+    squares = []
+    remaining = list(pieces)
+    for piece in tablePieces(signature):
+        for i, (other, sq) in enumerate(remaining):
+            if other == piece:
+                squares.append(sq)
+                del remaining[i]
+                break
+        else:
+            return None
+    return squares
+
+
+def flipPieces(pieces):
+    # swap the colours and turn the board over so black's ending can use white's table
+    return [(("b" if piece[0] == "w" else "w") + piece[1], sq ^ 56) for piece, sq in pieces]
+
+
+def canCaptureEnpassant(gs):
+    # the tables have no enpassant so only a position where it could be played is left out
+    if gs.enpassantPossible == ():
+        return False
+    r, c = gs.enpassantPossible
+    pawn = "wP" if gs.whiteToMove else "bP"
+    row = r + 1 if gs.whiteToMove else r - 1
+    return any(0 <= col < 8 and gs.board[row][col] == pawn for col in (c - 1, c + 1))
+
+
+def decodeValue(value):
+    # (result, plies) for the side to move, result 1 win, 0 draw, -1 loss
+    if value > 0:
+        return 1, value
+    if value < 0:
+        return -1, -value - 1
+    return 0, 0
+
+# %% --------------------------------------------------------------------------
+# Probing
+# -----------------------------------------------------------------------------
+
+
+class Tablebases:
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}  # signature to mmap, None if there is no file
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables = {}
+
+    def getTable(self, signature):
+        if signature not in self.tables:
+            path = os.path.join(self.directory, signature + ".tb")
+            table = None
+            if os.path.exists(path):
+                with open(path, "rb") as file:
+                    table = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                if table[:len(TABLE_HEADER)] != TABLE_HEADER:
+                    table.close()
+                    raise ValueError("{} is not a tablebase".format(path))
+            self.tables[signature] = table
+        return self.tables[signature]
+
+    def probePieces(self, pieces, whiteToMove):
+        # stored value for the side to move, 0 for bare kings, None if no table has the ending
+        if len(pieces) == 2:
+            return 0
+        for flipped in (False, True):
+            if flipped:
+                pieces = flipPieces(pieces)
+                whiteToMove = not whiteToMove
+            signature = signatureOf(pieces)
+            table = self.getTable(signature)
+            if table is not None:
+                squares = orderSquares(pieces, signature)
+                index = positionIndex(squares, "P" in signature) * 2 + (0 if whiteToMove else 1)
+                value = table[len(TABLE_HEADER) + index]
+                return value - 256 if value > 127 else value
+        return None
+
+    def probe(self, gs):
+        # stored value of the position or None if it isn't covered
+        if gs.castleRights or canCaptureEnpassant(gs):
+            return None
+        pieces = []
+        for r, row in enumerate(gs.board):
+            for c, piece in enumerate(row):
+                if piece != "--":
+                    if len(pieces) == MAX_PIECES:
+                        return None
+                    pieces.append((piece, r * 8 + c))
+        return self.probePieces(pieces, gs.whiteToMove)
+
+    def pickMove(self, gs, validMoves):
+        # the move that keeps the best result the quickest way (a win) or the slowest (a loss),
+        # None if a position isn't covered so the search has to decide
+        if not validMoves or self.probe(gs) is None:
+            return None
+        best, bestKey = None, None
+        for move in validMoves:
+            gs.makeMove(move)
+            value = self.probe(gs)
+            gs.undoMove()
+            if value is None:
+                return None
+            result, plies = decodeValue(value)
+            # the opponent's loss is our win, sort wins first and quickest, losses last and longest
+            key = (-result, -plies if result == -1 else plies)
+            if bestKey is None or key > bestKey:
+                best, bestKey = move, key
+        return best
+
+# %% --------------------------------------------------------------------------
+# Generating by retrograde analysis
+# -----------------------------------------------------------------------------
+
+
+def setUpPosition(gs, pieces, whiteToMove):
+    for row in gs.board:
+        for c in range(8):
+            row[c] = "--"
+    for piece, sq in pieces:
+        r, c = sq >> 3, sq & 7
+        gs.board[r][c] = piece
+        if piece == "wK":
+            gs.whiteKingLocation = (r, c)
+        elif piece == "bK":
+            gs.blackKingLocation = (r, c)
+    gs.whiteToMove = whiteToMove
+    gs.castleRights = 0
+    gs.enpassantPossible = ()
+    gs.moveLog = []
+    gs.checkmate = False
+    gs.stalemate = False
+    gs.zobristKey = gs.computeZobristKey()  # the move and attack caches are keyed on it
+
+
+def childPieces(pieces, move, promotion=None):
+    start = move.startRow * 8 + move.startCol
+    end = move.endRow * 8 + move.endCol
+    captured = move.startRow * 8 + move.endCol if move.isEnpassantMove else end
+    children = []
+    for piece, sq in pieces:
+        if sq == start:
+            children.append((piece[0] + promotion if promotion else piece, end))
+        elif sq != captured or move.pieceCaptured == "--":
+            children.append((piece, sq))
+    return children
+
+
+def generateTable(signature, directory, tablebases=None, log=print):
+    # works out every position of the ending and writes <directory>/<signature>.tb, tables of the
+    # endings it can turn into are made first if they aren't there
+    if tablebases is None:
+        tablebases = Tablebases(directory)
+    os.makedirs(directory, exist_ok=True)
+    start = time.perf_counter()
+    order = tablePieces(signature)
+    hasPawns = "P" in signature
+    kingSquares = KING_SQUARES[hasPawns]
+    positions = len(kingSquares) * 64 ** (len(order) - 1) * 2
+
+    gs = ce.GameState()
+    gs.moveCacheSize = 0
+    values = array("b", bytes(positions))
+    decided = bytearray(positions)
+    remaining = array("H", bytes(2 * positions))  # moves whose result isn't known yet
+    edgeChildren = array("I")  # moves within the table, child and parent index
+    edgeParents = array("I")
+    events = {}  # ply to [(parent index, child lost)] for results that come from other tables
+    newlyDecided = []
+
+    for kingSq in kingSquares:
+        for others in itertools.product(range(64), repeat=len(order) - 1):
+            squares = (kingSq,) + others
+            if len(set(squares)) != len(squares):
+                continue
+            pieces = list(zip(order, squares))
+            if any(piece[1] == "P" and sq >> 3 in (0, 7) for piece, sq in pieces):
+                continue
+            position = positionIndex(squares, hasPawns)
+            for whiteToMove in (True, False):
+                index = position * 2 + (0 if whiteToMove else 1)
+                setUpPosition(gs, pieces, whiteToMove)
+                enemyKing = gs.blackKingLocation if whiteToMove else gs.whiteKingLocation
+                if gs.squareAttackedBy(enemyKing[0], enemyKing[1], "w" if whiteToMove else "b"):
+                    continue  # the side that just moved is in check, can't happen
+                moves = gs.getValidMoves()
+                if not moves:
+                    decided[index] = 1
+                    if gs.checkmate:
+                        values[index] = -1
+                        newlyDecided.append(index)
+                    continue
+                for move in moves:
+                    promotion = move.promotionPiece if move.isPawnPromotion else None
+                    children = childPieces(pieces, move, promotion)
+                    if promotion is None and move.pieceCaptured == "--":
+                        edgeChildren.append(positionIndex([sq for _, sq in children], hasPawns) * 2 +
+                                            (1 if whiteToMove else 0))
+                        edgeParents.append(index)
+                        continue
+                    value = tablebases.probePieces(children, not whiteToMove)
+                    if value is None:
+                        childSignature = signatureOf(children)
+                        log("{} needs {}".format(signature, childSignature))
+                        generateTable(childSignature, directory, tablebases, log)
+                        value = tablebases.probePieces(children, not whiteToMove)
+                    if value:
+                        result, plies = decodeValue(value)
+                        events.setdefault(plies, []).append((index, result == -1))
+                    # a draw never counts down, so the position can't be lost
+                remaining[index] = len(moves)
+
+    # parents of each position, grouped by child so a result can be passed back in one sweep
+    offsets = array("I", bytes(4 * (positions + 1)))
+    for child in edgeChildren:
+        offsets[child + 1] += 1
+    for i in range(positions):
+        offsets[i + 1] += offsets[i]
+    fill = array("I", offsets)
+    parents = array("I", bytes(4 * len(edgeChildren)))
+    for child, parent in zip(edgeChildren, edgeParents):
+        parents[fill[child]] = parent
+        fill[child] += 1
+    del edgeChildren, edgeParents, fill
+
+    ply = 0
+    while newlyDecided or any(level >= ply for level in events):
+        # results found at this ply are passed back to the parents
+        levelEvents = events.pop(ply, [])
+        for child in newlyDecided:
+            lost = values[child] < 0
+            levelEvents.extend((parents[i], lost) for i in range(offsets[child], offsets[child + 1]))
+        newlyDecided = []
+        for parent, childLost in levelEvents:
+            if decided[parent]:
+                continue
+            if childLost:
+                values[parent] = ply + 1  # a move to a lost position wins
+                decided[parent] = 1
+                newlyDecided.append(parent)
+            else:
+                remaining[parent] -= 1
+                if remaining[parent] == 0:  # every move goes to a won position for the opponent
+                    values[parent] = -(ply + 1) - 1
+                    decided[parent] = 1
+                    newlyDecided.append(parent)
+        ply += 1
+
+    path = os.path.join(directory, signature + ".tb")
+    with open(path, "wb") as file:
+        file.write(TABLE_HEADER)
+        file.write(values.tobytes())
+    tablebases.tables.pop(signature, None)
+    log("{}: {} positions, longest mate {} plies, {:.1f}s".format(
+        signature, positions, max(max(values), -min(values) - 1), time.perf_counter() - start))
+    return path
+
+# %% --------------------------------------------------------------------------
+# Command line
+# -----------------------------------------------------------------------------
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate and probe endgame tablebases")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generateParser = commands.add_parser("generate", help="build tables for endings like KQvK")
+    generateParser.add_argument("signatures", nargs="+")
+    generateParser.add_argument("--dir", default="tablebases")
+    probeParser = commands.add_parser("probe", help="look a position up")
+    probeParser.add_argument("fen")
+    probeParser.add_argument("--dir", default="tablebases")
+    args = parser.parse_args(argv)
+
+    tablebases = Tablebases(args.dir)
+    if args.command == "generate":
+        for signature in args.signatures:
+            generateTable(signature, args.dir, tablebases)
+    else:
+        gs = ce.GameState()
+        gs.loadFEN(args.fen)
+        value = tablebases.probe(gs)
+        if value is None:
+            print("not in the tablebases")
+        else:
+            result, plies = decodeValue(value)
+            print({1: "win", 0: "draw", -1: "loss"}[result] + (" in {} plies".format(plies) if result else ""))
+            move = tablebases.pickMove(gs, gs.getValidMoves())
+            if move is not None:
+                print("best move {}".format(move.getChessNotation()))
+    tablebases.close()
+
+
+if __name__ == "__main__":
+    main()